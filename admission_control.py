@@ -0,0 +1,117 @@
+import math
+import threading
+import time
+
+import metrics
+
+# Requests for digits that still have to be computed are admitted by their cost.
+# The cost is counted in digits: every computation starts at the first digit after the point,
+# so digits up to end cost end, unless the cache or the digit store already contain them.
+# Already available digits cost nothing and are always admitted.
+# Every client key (the IP and the user, if known) has a token bucket holding up to capacity digits,
+# which is refilled with refill_rate digits per second. A request is admitted, when all its buckets hold its cost.
+# Costs larger than the capacity or max_cost are refused, even with a full bucket. Such amounts are computed by jobs
+# (see jobs.py). max_cost keeps a computation within the compute timeout: a running computation can't be cancelled,
+# so a request giving up on it would leave its process busy for much longer.
+# Besides, only max_heavy requests costing at least heavy_cost digits may compute at the same time.
+
+DEFAULT_CAPACITY = 5000000  # digits, 0 disables admission control
+DEFAULT_REFILL_RATE = 50000  # digits per second
+DEFAULT_HEAVY_COST = 200000  # digits
+DEFAULT_MAX_HEAVY = 2
+HEAVY_RETRY_AFTER = 5  # seconds
+# The time of a computation grows about quadratically with the digits: 1000000 digits of pi take about a minute.
+REFERENCE_DIGITS = 1000000
+REFERENCE_SECONDS = 60
+PRUNE_SIZE = 10000  # buckets, full buckets are forgotten beyond this
+
+ADMISSION_REJECTIONS = metrics.counter("pithon_admission_rejections_total",
+                                       "Requests rejected by the admission control, by reason")
+
+
+class OverBudgetError(RuntimeError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CostTooHighError(RuntimeError):
+    pass
+
+
+def get_max_cost(timeout):
+    """ Returns the digits, which can be computed within timeout seconds.
+        Half of the timeout is kept as a margin for slower machines and numbers.
+        """
+    return int(REFERENCE_DIGITS * math.sqrt(timeout / 2 / REFERENCE_SECONDS))
+
+
+def estimate_cost(end, available):
+    """ Returns the digits to compute for the digits up to end, when available digits are cached or stored. """
+    return 0 if end <= available else end
+
+
+class AdmissionController:
+    def __init__(self, capacity=DEFAULT_CAPACITY, refill_rate=DEFAULT_REFILL_RATE, heavy_cost=DEFAULT_HEAVY_COST,
+                 max_heavy=DEFAULT_MAX_HEAVY, max_cost=None):
+        """
+        :param capacity: digits a client may compute at once
+        :param refill_rate: digits per second a client may compute in the long run
+        :param heavy_cost: requests costing at least this many digits count as heavy
+        :param max_heavy: heavy requests computing at the same time
+        :param max_cost: digits one request may compute, None for the capacity
+        """
+        if capacity > 0 and refill_rate <= 0:
+            raise ValueError("refill_rate must be positive.")
+        self.capacity = capacity
+        self.max_cost = min(capacity, max_cost) if max_cost is not None else capacity
+        self.refill_rate = refill_rate
+        self.heavy_cost = heavy_cost
+        self._heavy_slots = threading.BoundedSemaphore(max_heavy)
+        self._buckets = {}  # key -> (tokens, time of last refill)
+        self._lock = threading.Lock()
+
+    def _get_tokens(self, key, now):
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - last) * self.refill_rate)
+
+    def admit(self, keys, cost):
+        """ Charges cost to the buckets of all keys. Returns True, if the request took a heavy slot,
+            which must be given back with release_heavy() after the computation.
+            Raises OverBudgetError with the seconds to wait, if the request is not admitted now,
+            and CostTooHighError, if it is never admitted.
+            """
+        if self.capacity <= 0 or cost <= 0:
+            return False
+        if cost > self.max_cost:
+            if metrics.enabled:
+                ADMISSION_REJECTIONS.inc(reason="cost")
+            raise CostTooHighError(f"{cost} digits have to be computed, but one request may compute at most "
+                                   f"{self.max_cost}.")
+        with self._lock:
+            now = time.monotonic()
+            tokens = {key: self._get_tokens(key, now) for key in keys}
+            missing = max(cost - value for value in tokens.values())
+            if missing > 0:
+                if metrics.enabled:
+                    ADMISSION_REJECTIONS.inc(reason="budget")
+                raise OverBudgetError("Too many digits requested. Please try again later.",
+                                      math.ceil(missing / self.refill_rate))
+            heavy = cost >= self.heavy_cost
+            if heavy and not self._heavy_slots.acquire(blocking=False):
+                if metrics.enabled:
+                    ADMISSION_REJECTIONS.inc(reason="heavy")
+                raise OverBudgetError("Too many large computations running. Please try again later.",
+                                      HEAVY_RETRY_AFTER)
+            if len(self._buckets) > PRUNE_SIZE:
+                self._prune(now)
+            for key, value in tokens.items():
+                self._buckets[key] = (value - cost, now)
+        return heavy
+
+    def release_heavy(self):
+        self._heavy_slots.release()
+
+    def _prune(self, now):
+        for key in [key for key in self._buckets if self._get_tokens(key, now) >= self.capacity]:
+            del self._buckets[key]
@@ -0,0 +1,68 @@
+"""
+Measures the latency of light endpoints while heavy digit requests are running,
+once with all computations in the web server process and once with the compute process pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_compute_pool [heavy_digits]
+"""
+import logging
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from web import create_app, CONFIG_COMPUTE_PROCESSES, CONFIG_COMPUTE_QUEUE_DEPTH
+
+LIGHT_PATHS = ["/", "/api?number=pi&index=5&amount=5"]
+HEAVY_CLIENTS = 2
+LIGHT_REQUESTS = 200
+
+
+def get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run(processes, heavy_digits):
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app(folder, {CONFIG_COMPUTE_PROCESSES: processes, CONFIG_COMPUTE_QUEUE_DEPTH: HEAVY_CLIENTS})
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        for path in LIGHT_PATHS:
+            get(base + path)  # Warm up
+        get(f"{base}/api?number=sqrt&n=2&index={heavy_digits}&amount=1")  # Starts the pool processes
+
+        running = threading.Event()
+        running.set()
+        radicands = iter(range(3, 10 ** 6))  # Every heavy request computes a new root
+
+        def heavy_client():
+            while running.is_set():
+                get(f"{base}/api?number=sqrt&n={next(radicands)}&index={heavy_digits}&amount=10")
+
+        heavy_threads = [threading.Thread(target=heavy_client) for _ in range(HEAVY_CLIENTS)]
+        for thread in heavy_threads:
+            thread.start()
+        time.sleep(0.5)
+        latencies = [get(base + LIGHT_PATHS[i % len(LIGHT_PATHS)]) for i in range(LIGHT_REQUESTS)]
+        running.clear()
+        for thread in heavy_threads:
+            thread.join()
+        server.shutdown()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"processes={processes}: light p50={percentiles[49] * 1000:.1f}ms p99={percentiles[98] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    digits = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    run(0, digits)
+    run(2, digits)
@@ -0,0 +1,107 @@
+"""
+Measures the concurrent read throughput (2 SELECTs per read) of the database, once like before the ConnectionManager
+(one shared connection, rollback journal, commit after every SELECT) and once with the ConnectionManager
+(WAL, one connection per thread, reads without commit). Writers keep updating indices in the meantime.
+Every measurement runs twice: with long-lived reader threads, and with a new thread for every read
+like the threaded werkzeug server, which starts one thread per request. Short-lived threads are measured
+once opening a connection of their own (pool size 0) and once taking one from the pool of the ConnectionManager.
+
+Run from the repository root:
+    python -m benchmarks.bench_database [threads]
+"""
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from database import ConnectionManager, create_db_tables, create_users_table, create_number_indices_table, \
+    create_test_users, db_get_current_index, db_get_rank, db_raise_current_index, TEST_USER_STD, DEFAULT_POOL_SIZE
+
+DURATION = 2  # seconds per measurement
+
+
+def legacy_read(conn, query, parameters):
+    # The read path before the ConnectionManager: shared cursor use and a commit after the SELECT
+    c = conn.cursor()
+    c.execute(query, parameters)
+    data = c.fetchone()
+    conn.commit()
+    return data
+
+
+def measure(threads, read, write, short_lived=False):
+    reads = [0] * threads
+    running = threading.Event()
+    running.set()
+
+    def reader(i):
+        while running.is_set():
+            if short_lived:
+                thread = threading.Thread(target=read)
+                thread.start()
+                thread.join()
+            else:
+                read()
+            reads[i] += 2
+
+    def writer():
+        while running.is_set():
+            write()
+            time.sleep(0.001)
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)] + [threading.Thread(target=writer)]
+    for worker in workers:
+        worker.start()
+    time.sleep(DURATION)
+    running.clear()
+    for worker in workers:
+        worker.join()
+    return sum(reads) / DURATION
+
+
+def main(threads=8):
+    with tempfile.TemporaryDirectory() as folder:
+        legacy = sqlite3.connect(Path(folder) / "legacy.db", check_same_thread=False)  # Rollback journal
+        create_users_table(legacy)
+        create_number_indices_table(legacy)
+        create_test_users(legacy)
+        legacy_lock = threading.Lock()  # A shared connection must not be used by two threads at once
+
+        def legacy_locked_read():
+            with legacy_lock:
+                legacy_read(legacy, "SELECT current_index FROM number_indices INNER JOIN users "
+                                    "ON users.user_id = number_indices.user_id "
+                                    "WHERE username =:username AND number =:number",
+                            {'username': TEST_USER_STD[0], 'number': "pi"})
+            with legacy_lock:
+                legacy_read(legacy, "SELECT rank FROM users WHERE username =:username",
+                            {'username': TEST_USER_STD[0]})
+
+        def legacy_write():
+            with legacy_lock:
+                db_raise_current_index(legacy, TEST_USER_STD[0], "e", 1)
+
+        path = Path(folder) / "pithon.db"
+        create_db_tables(path)
+        for short_lived in [False, True]:
+            before = measure(threads, legacy_locked_read, legacy_write, short_lived)
+            results = []
+            for pool_size in ([0] if short_lived else []) + [DEFAULT_POOL_SIZE]:
+                manager = ConnectionManager(path, pool_size)
+
+                def read():
+                    db_get_current_index(manager, TEST_USER_STD[0], "pi")
+                    db_get_rank(manager, TEST_USER_STD[0])
+                    manager.release()  # Like the teardown of a request
+
+                after = measure(threads, read, lambda: db_raise_current_index(manager, TEST_USER_STD[0], "e", 1),
+                                short_lived)
+                results.append(f"pool size {pool_size} {after:,.0f} reads/s")
+            print(f"{threads} {'short-lived' if short_lived else 'long-lived'} reader threads: "
+                  f"before {before:,.0f} reads/s, after: {', '.join(results)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
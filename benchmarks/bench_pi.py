@@ -0,0 +1,51 @@
+"""
+Compares the mpmath and the native (Chudnovsky) backend of Pi.
+For every size N, the time to compute N digits from scratch and the time to extend
+an existing computation from N to 1.1 * N digits are measured.
+
+Run from the repository root:
+    python -m benchmarks.bench_pi [max_exponent]
+Without gmpy2, mpmath and the native engine both use Python integers. 10^7 digits take a long time.
+"""
+import sys
+import time
+
+from digit_engines import ChudnovskyPi
+from irrational_digits import Pi, set_backend, BACKEND_MPMATH, BACKEND_NATIVE
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_mpmath(digits):
+    set_backend(BACKEND_MPMATH)
+    pi = Pi()
+    from_scratch = measure(pi.get_number_with_accuracy, digits)
+    extension = measure(pi.get_number_with_accuracy, digits + digits // 10)  # mpmath starts over
+    return from_scratch, extension
+
+
+def bench_native(digits):
+    set_backend(BACKEND_NATIVE)
+    Pi.engine = ChudnovskyPi()
+    pi = Pi()
+    from_scratch = measure(pi.get_number_with_accuracy, digits)
+    extension = measure(pi.get_number_with_accuracy, digits + digits // 10)
+    return from_scratch, extension
+
+
+def main(max_exponent=7):
+    print(f"{'digits':>10} | {'mpmath':>10} {'+10%':>10} | {'native':>10} {'+10%':>10}")
+    for exponent in range(4, max_exponent + 1):
+        digits = 10 ** exponent
+        mp_scratch, mp_extension = bench_mpmath(digits)
+        native_scratch, native_extension = bench_native(digits)
+        print(f"{digits:>10} | {mp_scratch:>9.3f}s {mp_extension:>9.3f}s | "
+              f"{native_scratch:>9.3f}s {native_extension:>9.3f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
@@ -0,0 +1,44 @@
+"""
+Measures the latency of requests using the session (/toggle_theme writes it, /admin and /digits read it)
+with every session backend.
+
+Run from the repository root:
+    python -m benchmarks.bench_sessions [requests]
+"""
+import statistics
+import sys
+import secrets
+import tempfile
+import time
+
+from database import TEST_USER_ADMIN
+from session_backends import SESSION_BACKENDS
+from web import create_app, CONFIG_SESSION_BACKEND, CONFIG_PRECOMPUTE_MARGIN
+
+PATHS = ["/toggle_theme", "/admin", "/digits"]
+
+
+def measure(backend, requests):
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app(folder, {CONFIG_SESSION_BACKEND: backend, CONFIG_PRECOMPUTE_MARGIN: 0,
+                                  "SECRET_KEY": secrets.token_hex(16)})
+        client = app.test_client()
+        client.post("/login", data={"username": TEST_USER_ADMIN[0], "password": TEST_USER_ADMIN[1]})
+        latencies = {path: [] for path in PATHS}
+        for _ in range(requests):
+            for path in PATHS:
+                start = time.perf_counter()
+                client.get(path)
+                latencies[path].append(time.perf_counter() - start)
+        return latencies
+
+
+def main(requests=500):
+    for backend in SESSION_BACKENDS:
+        latencies = measure(backend, requests)
+        print(f"{backend:>10}: " + ", ".join(f"{path} {statistics.median(times) * 1000:.2f} ms"
+                                             for path, times in latencies.items()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,175 @@
+"""
+Drives the app with many simulated users and reports the throughput and the latency percentiles of every endpoint.
+The server runs in its own process on a temporary folder, the clients are threads of this process,
+each with its own keep-alive connection. Everything stays on localhost.
+
+Run from the repository root:
+    python -m benchmarks.load_test [--mix mixed] [--clients 1,4,16,64] [--duration 10]
+                                   [--config '{"SESSION_BACKEND": "memory"}'] [--output results.json]
+--config overrides settings of create_app(), so server configurations can be compared.
+"""
+import argparse
+import base64
+import http.client
+import json
+import multiprocessing
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from database import TEST_USER_ADMIN
+
+NUMBERS = ["pi", "e", "sqrt2"]
+MAX_INDEX = 20000  # of random /api and /db reads
+# Weights of the operations of a simulated user
+MIXES = {"mixed": {"anonymous_read": 4, "user_walk": 3, "db_lookup": 2, "login": 1, "admin": 1},
+         "read": {"anonymous_read": 1, "db_lookup": 1},
+         "users": {"user_walk": 6, "login": 2, "admin": 1}}
+PASSWORD = "load_test"
+
+
+def serve(config, port_queue, stopped):
+    # Entry point of the server process, runs until stopped is set
+    import logging
+    from werkzeug.serving import make_server
+    from irrational_digits import set_executor
+    from web import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as folder:
+        server = make_server("127.0.0.1", 0, create_app(folder, config), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port_queue.put(server.server_port)
+        stopped.wait()
+        server.shutdown()
+        # A spawned process can't end, before its own pool processes have ended
+        set_executor(None, wait=True)
+
+
+def basic_auth(user, password):
+    return {"Authorization": "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()}
+
+
+class SimulatedUser:
+    def __init__(self, port, name):
+        self.port = port
+        self.name = name
+        self.connection = http.client.HTTPConnection("127.0.0.1", port)
+
+    def request(self, method, path, body=None, headers=None):
+        try:
+            self.connection.request(method, path, body, headers or {})
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port)
+            return None
+
+    def anonymous_read(self):
+        return self.request("GET", f"/api?number={random.choice(NUMBERS)}&index={random.randrange(MAX_INDEX)}"
+                                   f"&amount=10")
+
+    def user_walk(self):
+        return self.request("GET", f"/api/user?number={random.choice(NUMBERS)}&amount=10",
+                            headers=basic_auth(self.name, PASSWORD))
+
+    def db_lookup(self):
+        return self.request("GET", f"/db/{random.choice(NUMBERS)}/{random.randrange(MAX_INDEX)}")
+
+    def login(self):
+        return self.request("POST", "/login", urllib.parse.urlencode({"username": self.name, "password": PASSWORD}),
+                            {"Content-Type": "application/x-www-form-urlencoded"})
+
+    def admin(self):
+        return self.request("GET", "/admin/users", headers=basic_auth(*TEST_USER_ADMIN))
+
+
+def run_clients(port, clients, duration, mix):
+    """ Lets clients simulated users run for duration seconds. Returns {operation: ([latency], errors)}. """
+    users = [SimulatedUser(port, f"load{i}") for i in range(clients)]
+    for user in users:
+        user.request("POST", "/api", json.dumps({"username": user.name, "password": PASSWORD}),
+                     {"Content-Type": "application/json"})
+    operations, weights = zip(*MIXES[mix].items())
+    measurements = {operation: ([], [0]) for operation in operations}
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def simulate(user):
+        own = {operation: ([], [0]) for operation in operations}
+        while time.perf_counter() < end:
+            operation = random.choices(operations, weights)[0]
+            start = time.perf_counter()
+            status = getattr(user, operation)()
+            own[operation][0].append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                own[operation][1][0] += 1
+        with lock:
+            for operation, (latencies, errors) in own.items():
+                measurements[operation][0].extend(latencies)
+                measurements[operation][1][0] += errors[0]
+
+    threads = [threading.Thread(target=simulate, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {operation: (latencies, errors[0]) for operation, (latencies, errors) in measurements.items()}
+
+
+def summarize(measurements, duration):
+    summary = {}
+    for operation, (latencies, errors) in measurements.items():
+        if len(latencies) < 2:
+            continue
+        percentiles = statistics.quantiles(latencies, n=100)
+        summary[operation] = {"requests": len(latencies), "errors": errors, "throughput": len(latencies) / duration,
+                              "p50_ms": percentiles[49] * 1000, "p95_ms": percentiles[94] * 1000,
+                              "p99_ms": percentiles[98] * 1000}
+    return summary
+
+
+def print_summary(clients, summary):
+    total = sum(result["throughput"] for result in summary.values())
+    print(f"\n{clients} clients: {total:.0f} requests/s")
+    print(f"{'operation':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for operation, result in summary.items():
+        print(f"{operation:<16} {result['requests']:>9} {result['errors']:>7} {result['throughput']:>8.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", choices=MIXES, default="mixed")
+    parser.add_argument("--clients", default="1,4,16,64", help="comma separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per number of clients")
+    parser.add_argument("--config", default="{}", help="JSON settings for create_app()")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    port_queue, stopped = context.Queue(), context.Event()
+    server = context.Process(target=serve, args=(json.loads(args.config), port_queue, stopped))
+    server.start()
+    port = port_queue.get(timeout=60)
+    results = {}
+    try:
+        for clients in [int(clients) for clients in args.clients.split(",")]:
+            measurements = run_clients(port, clients, args.duration, args.mix)
+            results[clients] = summarize(measurements, args.duration)
+            print_summary(clients, results[clients])
+    finally:
+        stopped.set()
+        server.join()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"mix": args.mix, "config": json.loads(args.config), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
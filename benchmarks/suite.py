@@ -0,0 +1,174 @@
+"""
+Micro-benchmarks of the digit engines and the database layer. The results are saved as JSON,
+so a later run can be compared with them and regressions are flagged.
+
+Run from the repository root:
+    python -m benchmarks.suite [--quick] [--output results.json]
+    python -m benchmarks.suite --compare baseline.json [--tolerance 0.2]
+With --compare, the exit code is 1 if any result is worse than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from werkzeug.security import check_password_hash
+
+from credential_cache import CredentialCache
+from database import ConnectionManager, create_db_tables, create_number_digits_index_up_to, db_create_user, \
+    db_get_password, db_create_api_token, db_get_user_of_api_token, db_raise_current_index, \
+    db_raise_current_indices, TEST_USER_STD
+from digit_store import set_store_folder
+from irrational_digits import Pi, E, Sqrt2, set_backend, set_cache_budget, set_executor, BACKENDS, \
+    DEFAULT_CACHE_BUDGET
+
+NUMBERS = [Pi, E, Sqrt2]
+DEPTHS = [1000, 10000, 100000]
+QUICK_DEPTHS = [1000, 10000]
+REPEATS = 200  # of every fast measurement, the fastest is reported (the least disturbed by other processes)
+FILL_DIGITS = 100000
+PROGRESS_BATCH = 100
+COMPUTE_REPEATS = 3  # fresh processes per computation, the fastest is reported
+DEFAULT_TOLERANCE = 0.2
+
+
+def best_time(function, repeats=REPEATS):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def result(value, unit, higher_is_better=False):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def compute_in_fresh_process(number, backend, depth):
+    # Runs in a new interpreter, so no engine has computed anything yet
+    set_backend(backend)
+    start = time.perf_counter()
+    number().get_number_with_accuracy(depth)
+    return time.perf_counter() - start
+
+
+def bench_compute(depths):
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    # maxtasksperchild instead of max_tasks_per_child of ProcessPoolExecutor, which needs Python 3.11
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for number in NUMBERS:
+            for backend in BACKENDS:
+                for depth in depths:
+                    duration = min(pool.apply(compute_in_fresh_process, (number, backend, depth))
+                                   for _ in range(COMPUTE_REPEATS))
+                    results[f"compute/{number.name}/{backend}/{depth}"] = result(duration, "s")
+    return results
+
+
+def bench_reads(folder, depths):
+    # Digits served from the digit store, like most requests after the first ones
+    results = {}
+    set_store_folder(Path(folder) / "digits")
+    set_cache_budget(0)
+    for number in NUMBERS:
+        number().get_digits(max(depths) + 100, 1)  # Fills the store
+        for depth in depths:
+            results[f"get_digits/{number.name}/{depth}"] = \
+                result(best_time(lambda: number().get_digits(depth, 100)), "s")
+            results[f"get_digit_at_index/{number.name}/{depth}"] = \
+                result(best_time(lambda: number().get_digit_at_index(depth)), "s")
+    set_cache_budget(DEFAULT_CACHE_BUDGET)
+    return results
+
+
+def bench_database(folder):
+    results = {}
+    path = Path(folder) / "pithon.db"
+    create_db_tables(path)
+    conn = ConnectionManager(path)
+
+    Pi().get_digits(FILL_DIGITS, 1)  # Only the database is measured, the digits come from the store
+    start = time.perf_counter()
+    create_number_digits_index_up_to(conn, Pi, FILL_DIGITS - 1)
+    results["fill_digit_blocks/pi"] = result(FILL_DIGITS / (time.perf_counter() - start), "digits/s", True)
+
+    users = iter(range(10 ** 6))
+    results["create_user"] = result(best_time(lambda: db_create_user(conn, f"user{next(users)}", "pw"), 10), "s")
+    pw_hash = db_get_password(conn, TEST_USER_STD[0])
+    results["auth/password"] = result(best_time(lambda: check_password_hash(pw_hash, TEST_USER_STD[1]), 10), "s")
+    token = db_create_api_token(conn, TEST_USER_STD[0])
+    results["auth/token"] = result(best_time(lambda: db_get_user_of_api_token(conn, token)), "s")
+    cache = CredentialCache()
+    cache.add(*TEST_USER_STD)
+    results["auth/cached_password"] = result(best_time(lambda: cache.is_verified(*TEST_USER_STD)), "s")
+
+    results["progress/raise_index"] = \
+        result(best_time(lambda: db_raise_current_index(conn, TEST_USER_STD[0], "pi", 10)), "s")
+    increments = [(TEST_USER_STD[0], "e", 1)] * PROGRESS_BATCH
+    duration = best_time(lambda: db_raise_current_indices(conn, increments), 20)
+    results["progress/raise_indices_batch"] = result(PROGRESS_BATCH / duration, "raises/s", True)
+    return results
+
+
+def run(quick=False):
+    depths = QUICK_DEPTHS if quick else DEPTHS
+    set_executor(None)
+    results = bench_compute(depths)
+    with tempfile.TemporaryDirectory() as folder:
+        results.update(bench_reads(folder, depths))
+        results.update(bench_database(folder))
+        set_store_folder(None)
+    return {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                     "platform": platform.platform(), "quick": quick},
+            "results": results}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Prints every result next to its baseline. Returns the names of the results worse by more than tolerance. """
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, now in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {now['value']:>12.6g} {'new':>8}")
+            continue
+        change = now["value"] / before["value"] - 1
+        worse = -change if now["higher_is_better"] else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<40} {before['value']:>12.6g} {now['value']:>12.6g} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help=f"only depths {QUICK_DEPTHS}")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown before a result counts as regression")
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for name, measured in results["results"].items():
+            print(f"{name:<40} {measured['value']:>12.6g} {measured['unit']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+# Expensive computations are sent to a pool of processes, so they don't hold the GIL of the web workers.
+# Cheap computations run in the calling thread, because sending them to a process would cost more.
+
+DEFAULT_PROCESSES = 2
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_TIMEOUT = 120  # seconds
+DEFAULT_THRESHOLD = 20000  # digits
+
+
+class ComputeBusyError(RuntimeError):
+    pass
+
+
+class ComputeTimeoutError(RuntimeError):
+    def __init__(self, message, future):
+        super().__init__(message)
+        self.future = future  # The computation, which goes on in its process
+
+
+class ComputeExecutor:
+    def __init__(self, processes=DEFAULT_PROCESSES, queue_depth=DEFAULT_QUEUE_DEPTH, timeout=DEFAULT_TIMEOUT,
+                 threshold=DEFAULT_THRESHOLD):
+        """
+        :param processes: size of the process pool, 0 computes everything in the calling thread
+        :param queue_depth: maximum of computations running or waiting in the pool
+        :param timeout: seconds a request waits for its computation
+        :param threshold: computations of at least this many digits are sent to the pool
+        """
+        # "spawn" does not copy locks held by other threads of the web server into the new processes
+        self._pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) \
+            if processes > 0 else None
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self.timeout = timeout
+        self.threshold = threshold
+
+    def run(self, digits, function, *args):
+        """ Runs function(*args), which computes the given number of digits.
+            Raises ComputeBusyError, if the queue is full and ComputeTimeoutError after the timeout.
+            """
+        if self._pool is None or digits < self.threshold:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise ComputeBusyError("Too many computations running. Please try again later.")
+        try:
+            future = self._pool.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is kept until the computation really ends, even if the request gave up on it before
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise ComputeTimeoutError(f"Computation of {digits} digits took longer than {self.timeout}s.", future)
+
+    def shutdown(self, wait=False):
+        """ Cancels the waiting computations. wait=True also waits for the running ones and the processes to end. """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
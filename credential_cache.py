@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+# Checking a password hash is slow on purpose. A successful check is remembered for a few seconds,
+# so clients sending basic auth with every request don't pay for it each time.
+# Only a keyed hash of the password is kept in memory, never the password itself.
+# Every process has its own cache: a changed password may still be accepted by other processes until the TTL ends.
+
+DEFAULT_TTL = 60  # seconds
+
+
+class CredentialCache:
+    def __init__(self, ttl=DEFAULT_TTL):
+        """ :param ttl: seconds a verified password is remembered, 0 disables the cache """
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._verified = {}  # username -> (keyed password hash, expiry)
+        self._lock = threading.Lock()
+
+    def _hash(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def is_verified(self, user, password):
+        with self._lock:
+            entry = self._verified.get(user)
+        return entry is not None and entry[1] > time.monotonic() and hmac.compare_digest(entry[0], self._hash(password))
+
+    def add(self, user, password):
+        if self.ttl > 0:
+            with self._lock:
+                self._verified[user] = (self._hash(password), time.monotonic() + self.ttl)
+
+    def invalidate(self, user):
+        """ Forgets the password of user. Must be called when the password changes or the user is deleted. """
+        with self._lock:
+            self._verified.pop(user, None)
@@ -1,11 +1,28 @@
+import hashlib
 import os
+import secrets
 import sqlite3
+import threading
 from sqlite3 import Error
 from werkzeug.security import generate_password_hash
+from metrics import histogram, timed
 
 TEST_USER_ADMIN = ("joerg", "elsa")
 TEST_USER_STD = ("felix", "mady")
 FORBIDDEN_NAMES = ["getfile", "upto", "get"]  # These words once were commands. Kept for test- or future purposes.
+# Digits in table "number_digit_blocks" are packed two per byte (one per nibble) into blocks of this many digits.
+# Only the last block of a number can be shorter. An odd number of digits is padded with an "f" nibble.
+DIGIT_BLOCK_SIZE = 4096
+# WAL lets readers work next to a writer. With WAL, synchronous = NORMAL is still safe against corruption.
+CONNECTION_PRAGMAS = ["PRAGMA foreign_keys = ON;",
+                      "PRAGMA journal_mode = WAL;",
+                      "PRAGMA synchronous = NORMAL;",
+                      "PRAGMA temp_store = MEMORY;",
+                      "PRAGMA cache_size = -16000;",  # 16 MB
+                      "PRAGMA mmap_size = 268435456;"]  # 256 MB
+BUSY_TIMEOUT = 5  # seconds a connection waits for the lock of another writer
+DEFAULT_POOL_SIZE = 8  # idle connections kept open for the next threads
+QUERY_SECONDS = histogram("pithon_db_query_seconds", "Latency of SQL statements including fetch and commit")
 
 
 def create_connection(db_file):
@@ -20,51 +37,134 @@ def create_connection(db_file):
 
     conn = None
     try:
-        conn = sqlite3.connect(db_file, check_same_thread=False)
-        db_execute(conn, "PRAGMA foreign_keys = ON;", {})
+        conn = sqlite3.connect(db_file, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        for pragma in CONNECTION_PRAGMAS:
+            db_query(conn, pragma, {})
         return conn
     except Error as e:
         print(e)
 
 
+class ConnectionManager:
+    """ Lends every thread its own connection to the database file.
+        It can be used like a sqlite3 connection by all functions in this file,
+        so concurrent requests don't share cursors or wait for each other's commits.
+        Threads living for one request only (like in the threaded werkzeug server) give their connection back
+        with release(), so the next thread takes it from the pool instead of opening and setting up a new one.
+        """
+    def __init__(self, db_file, pool_size=DEFAULT_POOL_SIZE):
+        """ :param pool_size: at most this many released connections are kept open, more are closed """
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = create_connection(self.db_file)
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """ Gives the connection of the current thread back to the pool. The thread gets one again on its next use. """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def cursor(self):
+        return self.get_connection().cursor()
+
+    def commit(self):
+        self.get_connection().commit()
+
+    def executemany(self, query, parameter_list):
+        return self.get_connection().executemany(query, parameter_list)
+
+    def __enter__(self):
+        return self.get_connection().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.get_connection().__exit__(*exc_info)
+
+
+def db_execute_many(conn, query, parameter_list):
+    """ Executes query for all parameters in a single transaction. """
+    with timed(QUERY_SECONDS, statement=query):
+        try:
+            with conn:
+                conn.executemany(query, parameter_list)
+        except Error:
+            print(query)
+            print("Error in db_execute_many()")
+
+
+def db_query(conn, query, parameters, fetchall=False):
+    """ Like db_execute(), but for reading only, so nothing is committed. """
+    with timed(QUERY_SECONDS, statement=query):
+        c = conn.cursor()
+        try:
+            c.execute(query, parameters)
+        except Error:
+            print(query, parameters)
+            print("Error in db_query()")
+            return
+        if fetchall:
+            return c.fetchall()
+        return c.fetchone()
+
+
 def db_execute(conn, query, parameters, fetchall=False):
-    c = conn.cursor()
-    try:
-        c.execute(query, parameters)
-    except Error:
-        print(query, parameters)
-        print("Error in db_execute()")
-        return
-    if fetchall:
-        data = c.fetchall()
-    else:
-        data = c.fetchone()
-    conn.commit()
-    return data
+    with timed(QUERY_SECONDS, statement=query):
+        c = conn.cursor()
+        try:
+            c.execute(query, parameters)
+        except Error:
+            print(query, parameters)
+            print("Error in db_execute()")
+            return
+        if fetchall:
+            data = c.fetchall()
+        else:
+            data = c.fetchone()
+        conn.commit()
+        return data
 
 
 # <--- Get Functions for tables "users" and "number_indices" --->
 def db_get_all_user_data(conn, user):
-    data = db_execute(conn, "SELECT * FROM users WHERE username =:username",
+    data = db_query(conn, "SELECT * FROM users WHERE username =:username",
                       {'username': user})
     return data
 
 
 def db_get_all_user_names(conn):
-    data = db_execute(conn, "SELECT username FROM users", {}, fetchall=True)
+    data = db_query(conn, "SELECT username FROM users", {}, fetchall=True)
     usernames = [i[0] for i in data]  # Returns a normal tuple instead of the list of tuples in data
     return usernames
 
 
 def db_get_password(conn, user):
-    pw = db_execute(conn, "SELECT password FROM users WHERE username =:username", {'username': user})
+    pw = db_query(conn, "SELECT password FROM users WHERE username =:username", {'username': user})
     if pw is None:
         return None
     return pw[0]
 
 
 def db_get_current_index(conn, user, num):
-    index = db_execute(conn, "SELECT current_index FROM number_indices "
+    index = db_query(conn, "SELECT current_index FROM number_indices "
                              "INNER JOIN users ON users.user_id = number_indices.user_id "
                              "WHERE username =:username AND number =:number",
                        {'username': user, 'number': num})
@@ -75,21 +175,29 @@ def db_get_current_index(conn, user, num):
 
 
 def db_get_rank(conn, user):
-    rank = db_execute(conn, "SELECT rank FROM users WHERE username =:username", {'username': user})
+    rank = db_query(conn, "SELECT rank FROM users WHERE username =:username", {'username': user})
     return rank[0] if rank is not None else None
 
 
 def db_get_user_data_for_admin_panel(conn):
-    users_and_ranks = db_execute(conn, "SELECT username, rank FROM users", {}, fetchall=True)
-    numbers_and_indices = db_execute(conn, """SELECT number, current_index FROM users INNER JOIN number_indices
+    users_and_ranks = db_query(conn, "SELECT username, rank FROM users", {}, fetchall=True)
+    numbers_and_indices = db_query(conn, """SELECT number, current_index FROM users INNER JOIN number_indices
                                               ON users.user_id = number_indices.user_id""", {}, fetchall=True)
     return users_and_ranks, numbers_and_indices
 
 
+def db_get_max_current_indices(conn):
+    """ Returns {number: highest current_index of all users} """
+    indices = db_query(conn, "SELECT number, MAX(current_index) FROM number_indices GROUP BY number", {},
+                       fetchall=True)
+    return dict(indices or [])
+
+
 # <--- (Re)Set Functions for tables "users" and "number_indices" --->
 def db_set_password(conn, user, password):
     db_execute(conn, "UPDATE users SET password =:password WHERE username =:username",
                {'password': generate_password_hash(password), 'username': user})
+    db_delete_api_tokens(conn, user)  # Tokens issued with the old password are no longer valid
 
 
 def db_set_current_index(conn, user, num, index):
@@ -99,9 +207,44 @@ def db_set_current_index(conn, user, num, index):
                {'index': index, 'username': user, 'number': num})
 
 
+# UPDATE ... RETURNING needs SQLite 3.35, but the Docker image (Debian buster) has 3.27.
+# So the raised index is read in the same write transaction, which BEGIN IMMEDIATE takes before the update.
+RAISE_CURRENT_INDEX_QUERY = "UPDATE number_indices SET current_index = current_index + :increment " \
+                            "WHERE user_id = (SELECT user_id FROM users WHERE username =:username) " \
+                            "AND number =:number"
+GET_CURRENT_INDEX_QUERY = "SELECT current_index FROM number_indices " \
+                          "WHERE user_id = (SELECT user_id FROM users WHERE username =:username) AND number =:number"
+
+
+def raise_current_index(c, user, num, increment):
+    """ Raises the index with cursor c inside a write transaction.
+        :return: the raised index or -1, if the user does not exist
+        """
+    parameters = {'increment': increment, 'username': user, 'number': num}
+    c.execute(RAISE_CURRENT_INDEX_QUERY, parameters)
+    if c.rowcount == 0:
+        return -1
+    c.execute(GET_CURRENT_INDEX_QUERY, parameters)
+    return c.fetchone()[0]
+
+
 def db_raise_current_index(conn, user, num, increment):
-    updated_index = db_get_current_index(conn, user, num) + increment
-    db_set_current_index(conn, user, num, updated_index)
+    """ Raises the index in a single transaction, so concurrent raises can't get lost.
+        :return: the raised index or -1, if the user does not exist
+        """
+    return db_raise_current_indices(conn, [(user, num, increment)])[0]
+
+
+def db_raise_current_indices(conn, increments):
+    """ Raises many indices in one transaction.
+        :param increments: list of (user, num, increment)
+        :return: list of the raised indices, -1 for users that do not exist
+        """
+    with timed(QUERY_SECONDS, statement=RAISE_CURRENT_INDEX_QUERY):
+        with conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            return [raise_current_index(c, user, num, increment) for user, num, increment in increments]
 
 
 def db_reset_current_index(conn, user, num):
@@ -132,14 +275,14 @@ def db_create_user(conn, user, password, rank="std"):
         return None
     db_execute(conn, "INSERT INTO users (username, password, rank) VALUES (:username, :password, :rank)",
                {'username': user, 'password': generate_password_hash(password), 'rank': rank})
-    user_id = db_execute(conn, "SELECT user_id FROM users WHERE username =:username", {'username': user})
+    user_id = db_query(conn, "SELECT user_id FROM users WHERE username =:username", {'username': user})
     db_execute(conn, "INSERT INTO number_indices (user_id, number)"
                      "VALUES (:user_id, :pi), (:user_id, :e), (:user_id, :sqrt2)",
                {'user_id': user_id[0], 'pi': "pi", 'e': "e", 'sqrt2': "sqrt2"})
 
 
 def db_delete_user(conn, user):
-    user_id = db_execute(conn, "SELECT user_id FROM users WHERE username =:username", {'username': user})
+    user_id = db_query(conn, "SELECT user_id FROM users WHERE username =:username", {'username': user})
     if user_id is None:
         return
     # user var is a tuple when called with a delete request
@@ -150,32 +293,186 @@ def db_delete_user(conn, user):
 
 
 def db_is_user_existing(conn, user):
-    data = db_execute(conn, "SELECT username FROM users WHERE username =:username", {'username': user})
+    data = db_query(conn, "SELECT username FROM users WHERE username =:username", {'username': user})
     return data is not None
 
 
-# <--- Table "number_digits" for saving digits for endpoint "/db/<number>/<index> --->
+# <--- Table "api_tokens" for authentication without checking the password on every request --->
+# Only the sha256 hash of a token is saved. Tokens are random, so a fast hash is enough (unlike passwords).
+def hash_api_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def db_create_api_token(conn, user):
+    """ Returns a new token for user or None, if the user does not exist. """
+    token = secrets.token_urlsafe(32)
+    db_execute(conn, "INSERT INTO api_tokens (token_hash, user_id) "
+                     "SELECT :token_hash, user_id FROM users WHERE username =:username",
+               {'token_hash': hash_api_token(token), 'username': user})
+    return token if db_get_user_of_api_token(conn, token) is not None else None
+
+
+def db_get_user_of_api_token(conn, token):
+    user = db_query(conn, "SELECT username FROM api_tokens INNER JOIN users ON users.user_id = api_tokens.user_id "
+                          "WHERE token_hash =:token_hash", {'token_hash': hash_api_token(token)})
+    return user[0] if user is not None else None
+
+
+def db_delete_api_token(conn, token):
+    db_execute(conn, "DELETE FROM api_tokens WHERE token_hash =:token_hash", {'token_hash': hash_api_token(token)})
+
+
+def db_delete_api_tokens(conn, user):
+    db_execute(conn, "DELETE FROM api_tokens WHERE user_id = (SELECT user_id FROM users WHERE username =:username)",
+               {'username': user})
+
+
+# <--- Table "jobs" for computations running in the background (see jobs.py) --->
+JOB_QUEUED = "queued"
+JOB_COMPUTING = "computing"
+JOB_WRITING = "writing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_COLUMNS = ["job_id", "number", "radicand", "start_index", "amount", "state", "progress", "error", "created",
+               "finished", "client"]
+
+
+def db_create_job(conn, job_id, number, radicand, index, amount, created, client=None):
+    """ Creates a queued job. A failed job with the same id is queued again, other existing jobs are kept.
+        Returns True, if the job was created or queued again.
+        :param client: who submitted the job, like "ip:127.0.0.1"
+        """
+    # Without RETURNING (SQLite 3.35) the changed rows tell, if the job was created. A kept job changes none.
+    with timed(QUERY_SECONDS, statement="INSERT INTO jobs"), conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO jobs (job_id, number, radicand, start_index, amount, state, created, "
+                  "client) VALUES (:job_id, :number, :radicand, :start_index, :amount, :state, :created, :client) "
+                  "ON CONFLICT (job_id) DO UPDATE SET state = excluded.state, progress = 0, error = NULL, "
+                  "created = excluded.created, finished = NULL, client = excluded.client WHERE jobs.state =:failed",
+                  {'job_id': job_id, 'number': number, 'radicand': radicand, 'start_index': index, 'amount': amount,
+                   'state': JOB_QUEUED, 'created': created, 'client': client, 'failed': JOB_FAILED})
+        return c.rowcount > 0
+
+
+def db_count_jobs(conn, client=None):
+    """ Returns the number of jobs, which are not failed, and how many of them are unfinished jobs of client. """
+    counts = db_query(conn, "SELECT COUNT(*), COUNT(CASE WHEN client =:client AND state NOT IN (:done, :failed) "
+                            "THEN 1 END) FROM jobs WHERE state !=:failed",
+                      {'client': client, 'done': JOB_DONE, 'failed': JOB_FAILED})
+    return counts[0], counts[1]
+
+
+def db_get_job(conn, job_id):
+    """ Returns the job as dict of JOB_COLUMNS or None """
+    job = db_query(conn, f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id =:job_id", {'job_id': job_id})
+    return dict(zip(JOB_COLUMNS, job)) if job is not None else None
+
+
+def db_get_unfinished_job_ids(conn):
+    """ Returns the ids of all jobs, which are not done or failed, the oldest first """
+    job_ids = db_query(conn, "SELECT job_id FROM jobs WHERE state NOT IN (:done, :failed) ORDER BY created",
+                       {'done': JOB_DONE, 'failed': JOB_FAILED}, fetchall=True)
+    return [job_id for job_id, in job_ids or []]
+
+
+def db_set_job_state(conn, job_id, state, progress=0.0, error=None, finished=None):
+    db_execute(conn, "UPDATE jobs SET state =:state, progress =:progress, error =:error, finished =:finished "
+                     "WHERE job_id =:job_id",
+               {'job_id': job_id, 'state': state, 'progress': progress, 'error': error, 'finished': finished})
+
+
+def db_delete_jobs_finished_before(conn, before):
+    """ Deletes the jobs finished before the given time and returns their ids """
+    with timed(QUERY_SECONDS, statement="DELETE FROM jobs"), conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")  # No job can finish between the SELECT and the DELETE
+        c.execute("SELECT job_id FROM jobs WHERE finished <:before", {'before': before})
+        job_ids = [job_id for job_id, in c.fetchall()]
+        c.execute("DELETE FROM jobs WHERE finished <:before", {'before': before})
+    return job_ids
+
+
+# <--- Table "number_digit_blocks" for saving digits for endpoint "/db/<number>/<index> --->
+def pack_digits(digits):
+    return bytes.fromhex(digits + "f" * (len(digits) % 2))
+
+
+def unpack_digits(block):
+    return block.hex().rstrip("f")
+
+
+def db_get_number_digits_length(conn, number):
+    """ Returns how many digits (including the one before the ".") of number are saved in blocks. """
+    last_block = db_query(conn, "SELECT block_no, digits FROM number_digit_blocks WHERE number =:number "
+                                "ORDER BY block_no DESC LIMIT 1", {'number': number.name})
+    return last_block[0] * DIGIT_BLOCK_SIZE + len(unpack_digits(last_block[1])) if last_block is not None else 0
+
+
+def get_number_digits_end(digit_index):
+    """ Returns the digit after the block containing digit_index, blocks are always filled completely. """
+    return (int(digit_index) // DIGIT_BLOCK_SIZE + 1) * DIGIT_BLOCK_SIZE
+
+
 def get_digit_from_number_digits(conn, number, digit_index):
-    def get_data():
-        return db_execute(conn, "SELECT digit FROM number_digits WHERE number =:number AND digit_index =:digit_index",
-                          {'number': number.name, 'digit_index': digit_index})
+    block_no, offset = divmod(int(digit_index), DIGIT_BLOCK_SIZE)
 
-    data = get_data()
-    if data is None:
+    def get_block():
+        data = db_query(conn, "SELECT digits FROM number_digit_blocks WHERE number =:number AND block_no =:block_no",
+                          {'number': number.name, 'block_no': block_no})
+        return unpack_digits(data[0]) if data is not None else ""
+
+    block = get_block()
+    if len(block) <= offset:
         create_number_digits_index_up_to(conn, number, digit_index)
-        data = get_data()
-    return str(data[0])
+        block = get_block()
+    return block[offset]
 
 
 def create_number_digits_index_up_to(conn, number, digit_index):
-    next_index = int(db_execute(conn, "SELECT COUNT(*) FROM number_digits WHERE number =:number",
-                                {'number': number.name})[0])
-    all_digits = number().get_number_with_accuracy(int(digit_index))
-    all_digits = all_digits.replace('.', '')
-    for i in range(next_index, int(digit_index) + 1):
-        db_execute(conn, "INSERT INTO number_digits (number, digit_index, digit)"
-                         "VALUES (:number, :digit_index, :digit)",
-                   {'number': number.name, 'digit_index': i, 'digit': all_digits[i]})
+    # Fills all blocks up to the one containing digit_index. A partly filled last block is replaced.
+    last_block = db_query(conn, "SELECT block_no, digits FROM number_digit_blocks WHERE number =:number "
+                                  "ORDER BY block_no DESC LIMIT 1", {'number': number.name})
+    if last_block is None:
+        start = 0
+    elif len(unpack_digits(last_block[1])) < DIGIT_BLOCK_SIZE:
+        start = last_block[0] * DIGIT_BLOCK_SIZE
+    else:
+        start = (last_block[0] + 1) * DIGIT_BLOCK_SIZE
+    end = get_number_digits_end(digit_index)
+    if end <= start:
+        return
+    # Digit 0 is the one before the ".", digit i > 0 is digit i - 1 after the "."
+    number_instance = number()
+    if start == 0:
+        all_digits = number_instance.first_digit + number_instance.get_fraction(0, end - 1)
+    else:
+        all_digits = number_instance.get_fraction(start - 1, end - 1)
+    db_execute_many(conn, "INSERT OR REPLACE INTO number_digit_blocks (number, block_no, digits) "
+                          "VALUES (?, ?, ?)",
+                    [(number.name, (start + i) // DIGIT_BLOCK_SIZE, pack_digits(all_digits[i:i + DIGIT_BLOCK_SIZE]))
+                     for i in range(0, len(all_digits), DIGIT_BLOCK_SIZE)])
+
+
+def migrate_number_digits_table(conn):
+    # Databases of older versions saved one row per digit in table "number_digits".
+    # Their digits are moved into blocks, then the old table is dropped.
+    if db_query(conn, "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'number_digits'", {}) is None:
+        return
+    rows = db_query(conn, "SELECT number, digit_index, digit FROM number_digits ORDER BY number, digit_index",
+                      {}, fetchall=True)
+    digits_of_numbers = {}
+    for number, digit_index, digit in rows:
+        digits = digits_of_numbers.setdefault(number, [])
+        if digit_index == len(digits):  # Only the gapless digits from index 0 on can be moved
+            digits.append(str(digit))
+    blocks = []
+    for number, digits in digits_of_numbers.items():
+        digits = "".join(digits)
+        blocks += [(number, i // DIGIT_BLOCK_SIZE, pack_digits(digits[i:i + DIGIT_BLOCK_SIZE]))
+                   for i in range(0, len(digits), DIGIT_BLOCK_SIZE)]
+    db_execute_many(conn, "INSERT OR REPLACE INTO number_digit_blocks (number, block_no, digits) VALUES (?, ?, ?)",
+                    blocks)
+    db_execute(conn, "DROP TABLE number_digits", {})
 
 
 # <--- Create all database tables and test users below.  --->
@@ -183,8 +480,10 @@ def create_db_tables(path):
     conn = create_connection(path)
     create_users_table(conn)
     create_number_indices_table(conn)
-    create_number_digits_table(conn)
-    create_sql_indices(conn)
+    create_number_digit_blocks_table(conn)
+    create_api_tokens_table(conn)
+    create_jobs_table(conn)
+    migrate_number_digits_table(conn)
     create_test_users(conn)
 
 
@@ -209,16 +508,41 @@ def create_number_indices_table(conn):
                     ); """, {})
 
 
-def create_number_digits_table(conn):
-    db_execute(conn, """ CREATE TABLE IF NOT EXISTS number_digits (
-                    number text,
-                    digit_index integer,
-                    digit integer
-                    ); """, {})
+def create_number_digit_blocks_table(conn):
+    db_execute(conn, """ CREATE TABLE IF NOT EXISTS number_digit_blocks (
+                    number text NOT NULL,
+                    block_no integer NOT NULL,
+                    digits blob NOT NULL,
+                    PRIMARY KEY (number, block_no)
+                    ) WITHOUT ROWID; """, {})
 
 
-def create_sql_indices(conn):
-    db_execute(conn, "CREATE INDEX IF NOT EXISTS number_digits_idx ON number_digits (number, digit_index)", {})
+def create_api_tokens_table(conn):
+    db_execute(conn, """ CREATE TABLE IF NOT EXISTS api_tokens (
+                    token_hash text PRIMARY KEY,
+                    user_id integer NOT NULL,
+                    created timestamp DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id)
+                        REFERENCES users (user_id)
+                        ON DELETE CASCADE
+                        ON UPDATE CASCADE
+                    ) WITHOUT ROWID; """, {})
+
+
+def create_jobs_table(conn):
+    db_execute(conn, """ CREATE TABLE IF NOT EXISTS jobs (
+                    job_id text PRIMARY KEY,
+                    number text NOT NULL,
+                    radicand integer,
+                    start_index integer NOT NULL,
+                    amount integer NOT NULL,
+                    state text NOT NULL,
+                    progress real DEFAULT 0,
+                    error text,
+                    created real NOT NULL,
+                    finished real,
+                    client text
+                    ) WITHOUT ROWID; """, {})
 
 
 def create_test_users(conn):
@@ -0,0 +1,184 @@
+import math
+import threading
+from collections import OrderedDict
+from mpmath.libmp import numeral
+
+# Native engines computing the digits of a number with integers only.
+# Every engine keeps the state of its last computation, so computing more digits
+# only costs the new terms instead of starting over.
+
+# Digits computed behind the requested accuracy, so the returned digits are exact (truncated, not rounded).
+GUARD_DIGITS = 10
+# Number of root engines kept in the cache of get_root_engine()
+ROOT_ENGINE_CACHE_SIZE = 64
+
+_root_engines = OrderedDict()
+_root_engines_lock = threading.Lock()
+
+
+def format_scaled_number(scaled: int, accuracy: int) -> str:
+    """ Formats floor(x * 10**accuracy) like IrrationalDigits.get_number_with_accuracy(), e.g. "3.14" """
+    digits = numeral(scaled, size=accuracy + 1)
+    if accuracy == 0:
+        return digits
+    return f"{digits[:-accuracy]}.{digits[-accuracy:]}"
+
+
+class ChudnovskyPi:
+    """ Pi with the Chudnovsky series and binary splitting.
+        P, Q and T of the terms [0, terms) are kept, so more terms are merged into them.
+        """
+    C3_OVER_24 = 640320 ** 3 // 24
+    DIGITS_PER_TERM = math.log10(C3_OVER_24 / 72)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.terms = 1
+        self.p, self.q, self.t = 1, 1, 13591409  # State of the first term [0, 1)
+
+    def _binary_split(self, a, b):
+        if b - a == 1:
+            p = (6 * a - 5) * (2 * a - 1) * (6 * a - 1)
+            q = a * a * a * self.C3_OVER_24
+            t = p * (13591409 + 545140134 * a)
+            return p, q, -t if a % 2 else t
+        m = (a + b) // 2
+        p1, q1, t1 = self._binary_split(a, m)
+        p2, q2, t2 = self._binary_split(m, b)
+        return p1 * p2, q1 * q2, q2 * t1 + p1 * t2
+
+    def extend_to(self, terms):
+        """ Merges the terms [self.terms, terms) into the saved state. """
+        with self._lock:
+            if terms > self.terms:
+                p, q, t = self._binary_split(self.terms, terms)
+                self.p, self.q, self.t = self.p * p, self.q * q, q * self.t + self.p * t
+                self.terms = terms
+            return self.q, self.t
+
+    def get_number_with_accuracy(self, accuracy: int) -> str:
+        precision = accuracy + GUARD_DIGITS
+        q, t = self.extend_to(int(precision / self.DIGITS_PER_TERM) + 2)
+        # Q/T is only needed with the relative precision of the result, which makes the division much cheaper
+        shift = max(0, t.bit_length() - int(precision * math.log2(10)) - 64)
+        q, t = q >> shift, t >> shift
+        sqrt_c = get_root_engine(10005, 2).get_scaled(precision)
+        scaled = (426880 * sqrt_c * q) // t
+        return format_scaled_number(scaled // 10 ** GUARD_DIGITS, accuracy)
+
+
+class SeriesE:
+    """ E with the series 1 + 1/1! + 1/2! + ... and binary splitting.
+        Q and T of the terms [1, terms) are kept, so more terms are merged into them.
+        """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.terms = 1
+        self.q, self.t = 1, 0  # State of no terms [1, 1)
+
+    @staticmethod
+    def terms_for_precision(precision):
+        """ Returns the smallest number of terms n with n! > 10**precision """
+        def log_factorial(n):
+            return math.lgamma(n + 1) / math.log(10)
+
+        low, high = 1, 2
+        while log_factorial(high) <= precision:
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if log_factorial(middle) <= precision:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def _binary_split(self, a, b):
+        if b - a == 1:
+            return a, 1
+        m = (a + b) // 2
+        q1, t1 = self._binary_split(a, m)
+        q2, t2 = self._binary_split(m, b)
+        return q1 * q2, t1 * q2 + t2
+
+    def extend_to(self, terms):
+        """ Merges the terms [self.terms, terms) into the saved state. """
+        with self._lock:
+            if terms > self.terms:
+                q, t = self._binary_split(self.terms, terms)
+                self.q, self.t = self.q * q, self.t * q + t
+                self.terms = terms
+            return self.q, self.t
+
+    def get_number_with_accuracy(self, accuracy: int) -> str:
+        precision = accuracy + GUARD_DIGITS
+        q, t = self.extend_to(self.terms_for_precision(precision + 1) + 1)
+        shift = max(0, q.bit_length() - int(precision * math.log2(10)) - 64)
+        q, t = q >> shift, t >> shift
+        one = 10 ** precision
+        scaled = one + (t * one) // q
+        return format_scaled_number(scaled // 10 ** GUARD_DIGITS, accuracy)
+
+
+class IntegerRoot:
+    """ The degree-th root of radicand with integers only.
+        The root with the highest accuracy so far is kept and refined with Newton steps
+        when more digits are needed, so every step only has to double the correct digits.
+        """
+    def __init__(self, radicand: int, degree: int = 2):
+        self._lock = threading.Lock()
+        self.radicand = radicand
+        self.degree = degree
+        root = round(radicand ** (1 / degree))
+        while root ** degree > radicand:
+            root -= 1
+        while (root + 1) ** degree <= radicand:
+            root += 1
+        self.integer_part = root
+        self.accuracy = 0
+        self.root = root  # floor(radicand ** (1 / degree) * 10 ** accuracy)
+
+    def _newton(self, accuracy, start):
+        # Integer Newton iteration for floor(x ** (1 / degree)), converging from the upper bound start
+        k = self.degree
+        x_power = self.radicand * 10 ** (k * accuracy)
+        x = start
+        while True:
+            y = ((k - 1) * x + x_power // x ** (k - 1)) // k
+            if y >= x:
+                return x
+            x = y
+
+    def get_scaled(self, accuracy: int) -> int:
+        """ Returns floor(radicand ** (1 / degree) * 10 ** accuracy) """
+        with self._lock:
+            if accuracy <= self.accuracy:
+                return self.root // 10 ** (self.accuracy - accuracy)
+            if self.degree == 2 and accuracy > 2 * self.accuracy:
+                self.root, self.accuracy = math.isqrt(self.radicand * 10 ** (2 * accuracy)), accuracy
+                return self.root
+            steps = [accuracy]
+            while steps[-1] > 2 * self.accuracy + 16:
+                steps.append(steps[-1] // 2 + 1)
+            for step in reversed(steps):
+                # (root + 1) at a lower accuracy is an upper bound of the root at a higher accuracy
+                start = (self.root + 1) * 10 ** (step - self.accuracy)
+                self.root, self.accuracy = self._newton(step, start), step
+            return self.root
+
+    def get_number_with_accuracy(self, accuracy: int) -> str:
+        return format_scaled_number(self.get_scaled(accuracy), accuracy)
+
+
+def get_root_engine(radicand: int, degree: int = 2) -> IntegerRoot:
+    """ Returns the cached root engine of radicand, so popular roots are only computed once. """
+    with _root_engines_lock:
+        key = (radicand, degree)
+        engine = _root_engines.get(key)
+        if engine is None:
+            engine = IntegerRoot(radicand, degree)
+            _root_engines[key] = engine
+            if len(_root_engines) > ROOT_ENGINE_CACHE_SIZE:
+                _root_engines.popitem(last=False)
+        _root_engines.move_to_end(key)
+        return engine
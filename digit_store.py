@@ -0,0 +1,105 @@
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+
+from file_lock import file_lock
+
+# Persistent, append-only store for the digits after the decimal point of a number.
+# The digits are packed two per byte (one per nibble), so bytes.fromhex() and bytes.hex()
+# convert between the packed file and digit strings at C speed.
+# File layout: 8 byte header with the number of stored digits, followed by the packed digits.
+# The header is only raised after the digits are written, so readers never see unwritten digits.
+# Writers of all processes hold the file lock, so a shorter extend can never lower the header of a longer one.
+
+HEADER = struct.Struct("<Q")
+
+_store_folder = None
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def set_store_folder(folder):
+    """ Selects the folder in which the digit stores are kept.
+        :param folder: folder for the store files, None disables the stores
+        """
+    global _store_folder
+    with _stores_lock:
+        _stores.clear()
+        _store_folder = Path(folder) if folder is not None else None
+        if _store_folder is not None:
+            os.makedirs(_store_folder, exist_ok=True)
+
+
+def get_store(name):
+    """ Returns the digit store of the number with the given name
+        or None, if no store folder is set.
+        """
+    with _stores_lock:
+        if _store_folder is None:
+            return None
+        store = _stores.get(name)
+        if store is None:
+            store = DigitStore(_store_folder / f"{name}.digits")
+            _stores[name] = store
+        return store
+
+
+class DigitStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._mmap = None
+        if not self.path.exists():
+            with file_lock(self.path):
+                if not self.path.exists():  # Another process may have created and extended it meanwhile
+                    new_path = self.path.with_name(f"{self.path.name}.new")
+                    with open(new_path, "wb") as f:
+                        f.write(HEADER.pack(0))
+                    os.replace(new_path, self.path)  # Readers of other processes never see a file without header
+
+    def __len__(self):
+        return HEADER.unpack_from(self._get_mmap(HEADER.size))[0]
+
+    def _get_mmap(self, size):
+        # The mapping is shared, so the header is always up-to-date. It only has to be
+        # renewed when digits behind the end of the current mapping are requested.
+        m = self._mmap
+        if m is None or len(m) < size:
+            with open(self.path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap = m  # Older mappings are closed by the garbage collector once no reader uses them
+        return m
+
+    def read(self, start: int, amount: int) -> str:
+        """ Returns the stored digits from start to start + amount.
+            The caller has to make sure that these digits are stored.
+            """
+        end = start + amount
+        if start < 0 or amount < 0 or end > len(self):
+            raise IndexError(f"digits {start} to {end} are not in {self.path.name}")
+        first_byte = HEADER.size + start // 2
+        last_byte = HEADER.size + (end + 1) // 2
+        digits = self._get_mmap(last_byte)[first_byte:last_byte].hex()
+        return digits[start % 2:start % 2 + amount]
+
+    def extend(self, digits: str):
+        """ Appends the part of digits that is not stored yet.
+            :param digits: all digits after the decimal point, starting at the first one
+            """
+        with self._lock, file_lock(self.path):
+            length = len(self)
+            if len(digits) <= length:
+                return
+            # A half filled last byte is written again together with the new digits.
+            start = length - length % 2
+            new_digits = digits[start:]
+            if len(new_digits) % 2:
+                new_digits += "0"
+            with open(self.path, "r+b") as f:
+                f.seek(HEADER.size + start // 2)
+                f.write(bytes.fromhex(new_digits))
+                f.flush()
+                f.seek(0)
+                f.write(HEADER.pack(len(digits)))
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Several web server processes append to the same txt files, so every access holds an exclusive lock.
+# The lock is taken on a separate ".lock" file, so the txt file itself can be truncated while it is held.
+# flock() locks also exclude threads of the same process, because every call opens the lock file again.
+
+
+@contextmanager
+def file_lock(path):
+    """ Holds the exclusive lock of the file at path, until the with block ends. """
+    with open(f"{path}.lock", "a+b") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)  # Gives up after 10 seconds
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
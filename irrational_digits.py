@@ -1,12 +1,110 @@
+import os
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import nullcontext
 import mpmath
-from database import create_connection, db_get_current_index, db_raise_current_index
+import metrics
+from database import db_raise_current_index
+from digit_engines import ChudnovskyPi, SeriesE, get_root_engine
+from digit_store import get_store
+from file_lock import file_lock
+from single_flight import SingleFlight
 
 
 # Contains all the Classes for Irrational numbers
 
-# For rounding reasons, mpmath.mp.dps must be set 1 higher and the resulting string
+# For rounding reasons, the mpmath precision must be set 1 higher and the resulting string
 # must be cut by the last digit in most functions.
+# Every thread computes with its own mpmath context, the global mpmath.mp is never changed.
+
+# Digits after the decimal point are kept in a digit store (see digit_store.py), if one is set.
+# The store is extended by at least STORE_GROWTH, so following requests can be served from the store.
+STORE_MIN_EXTENSION = 1000
+STORE_GROWTH = 1.25
+# Computed digits are only stored with this many further digits computed behind them,
+# so rounding of the last digits can not end up in the store.
+STORE_GUARD_DIGITS = 10
+# Streams read the digits in blocks. Only the first block is computed on its own, so it can be sent quickly.
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# The largest computed expansion of every number is kept in memory, until the cache exceeds its budget
+DEFAULT_CACHE_BUDGET = 64 * 1024 * 1024  # bytes
+
+# Computations can be sent to a ComputeExecutor (see compute_executor.py) with set_executor()
+_executor = None
+# Concurrent computations of the same number are coalesced into one
+_flights = SingleFlight()
+
+COMPUTE_SECONDS = metrics.histogram("pithon_compute_seconds",
+                                    "Time to compute a number, in the process pool or in the web server")
+DIGIT_READS = metrics.counter("pithon_digit_reads_total", "Digit reads by the source serving them")
+
+
+def get_precision_bucket(digits):
+    """ Returns the power of 10 digits is rounded up to, like "1e4" for 1500 digits. """
+    return f"1e{len(str(max(digits - 1, 1)))}"
+
+# Backends computing the numbers. "native" uses the engine of a number (see digit_engines.py), if it has one.
+BACKEND_MPMATH = "mpmath"
+BACKEND_NATIVE = "native"
+BACKENDS = [BACKEND_MPMATH, BACKEND_NATIVE]
+
+# Roots served besides the fixed numbers, e.g. Root(3, ROOT_DEGREES["cbrt"]) for the cube root of 3
+ROOT_DEGREES = {"sqrt": 2, "cbrt": 3}
+MAX_RADICAND = 10 ** 6
+
+
+class ExpansionCache:
+    """ Keeps the largest computed expansion (digits after the decimal point) of every number.
+        When the expansions take more than budget bytes, the least recently used numbers are evicted.
+        """
+    def __init__(self, budget=DEFAULT_CACHE_BUDGET):
+        self._lock = threading.Lock()
+        self._expansions = OrderedDict()
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name, end):
+        """ Returns the cached expansion of name, if it contains the digits up to end, otherwise None """
+        with self._lock:
+            expansion = self._expansions.get(name)
+            if expansion is None or len(expansion) < end:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._expansions.move_to_end(name)
+            return expansion
+
+    def get_length(self, name):
+        """ Returns the number of cached digits of name, without counting it as hit or miss """
+        with self._lock:
+            return len(self._expansions.get(name, ""))
+
+    def put(self, name, expansion):
+        with self._lock:
+            cached = self._expansions.get(name)
+            if len(expansion) > self.budget or (cached is not None and len(cached) >= len(expansion)):
+                return
+            if cached is not None:
+                self.size -= len(self._expansions.pop(name))
+            while self.size + len(expansion) > self.budget:
+                _, evicted = self._expansions.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+            self._expansions[name] = expansion
+            self.size += len(expansion)
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": self.size,
+                    "budget": self.budget, "numbers": {name: len(e) for name, e in self._expansions.items()}}
+
+
+_cache = ExpansionCache()
 
 
 class IrrationalDigits(ABC):
@@ -18,85 +116,268 @@ class IrrationalDigits(ABC):
     def get_number_with_accuracy(accuracy):
         pass
 
+    @property
+    def digit_store(self):
+        return get_store(self.name)
+
     def get_digit_at_index(self, index):
-        i_num = self.get_number_with_accuracy(index)
-        return i_num[-1]
+        if index == 0:
+            return self.first_digit
+        return self.get_fraction(index - 1, index)
 
     def get_digits(self, index: int, amount: int) -> str:
         if index < 0 or amount < 0:
             print(f"index or amount too small in get_digits():\nindex={index} & amount={amount}")
             raise ValueError
-        i_num = self.get_number_with_accuracy(index + amount)
         if index == 0:
-            return i_num[-amount-2:]
-        return i_num[-amount:]
+            if amount == 0:
+                return self.first_digit
+            return f"{self.first_digit}.{self.get_fraction(0, amount)}"
+        return self.get_fraction(index, index + amount)
+
+    def get_fraction(self, start: int, end: int, min_target: int = 0) -> str:
+        """ Returns the digits after the decimal point from start to end (exclusive).
+            Only computes the number, if neither the cache nor the digit store contain these digits yet.
+            :param min_target: compute (and store) at least up to this digit, if the digits have to be computed
+            """
+        cached = _cache.get(self.name, end)
+        if cached is not None:
+            if metrics.enabled:
+                DIGIT_READS.inc(source="cache")
+            return cached[start:end]
+        store = self.digit_store
+        if store is None:
+            if metrics.enabled:
+                DIGIT_READS.inc(source="computation")
+            # Without a store, the following blocks of a stream are read from the cache filled here
+            return _flights.run(self.name, max(end, min_target), self.compute_and_cache_fraction)[start:end]
+        if metrics.enabled:
+            DIGIT_READS.inc(source="store" if len(store) >= end else "computation")
+        if len(store) < end:
+            self._compute_into_store(store, end, min_target)
+        return store.read(start, end - start)
+
+    def _compute_into_store(self, store, end: int, min_target: int = 0):
+        def compute_and_store(amount):
+            fraction = self.compute_and_cache_fraction(amount)
+            store.extend(fraction)
+            return fraction
+
+        target = max(end, min_target, int(len(store) * STORE_GROWTH), STORE_MIN_EXTENSION)
+        _flights.run(self.name, target, compute_and_store)
+
+    def extend_store(self, end: int):
+        """ Extends the digit store up to at least end digits after the decimal point, from the cache if possible. """
+        store = self.digit_store
+        if store is None or len(store) >= end:
+            return
+        cached = _cache.get(self.name, end)
+        if cached is not None:
+            store.extend(cached)
+        else:
+            self._compute_into_store(store, end)
+
+    def get_available_digits(self) -> int:
+        """ Returns how many digits after the decimal point can be read without computing. """
+        store = self.digit_store
+        return max(_cache.get_length(self.name), len(store) if store is not None else 0)
+
+    def iter_fraction(self, start: int, end: int, block_size: int = STREAM_BLOCK_SIZE):
+        """ Yields the digits after the decimal point from start to end (exclusive) in blocks of block_size,
+            so only one block at a time has to be held by the caller.
+            """
+        for block_start in range(start, end, block_size):
+            min_target = end if block_start > start else 0  # The following blocks are computed at once
+            yield self.get_fraction(block_start, min(block_start + block_size, end), min_target)
+
+    def compute_fraction(self, amount: int) -> str:
+        """ Computes the first amount digits after the decimal point. """
+        i_num = self.get_number_with_accuracy(amount + STORE_GUARD_DIGITS)
+        return i_num[len(self.first_digit) + 1:][:amount]
+
+    def compute_and_cache_fraction(self, amount: int) -> str:
+        fraction = self.compute_fraction_with_executor(amount)
+        _cache.put(self.name, fraction)
+        return fraction
+
+    def prewarm(self, depth: int):
+        """ Loads the first depth digits after the decimal point into the cache. """
+        _cache.put(self.name, self.get_fraction(0, depth))
+
+    def compute_fraction_with_executor(self, amount: int) -> str:
+        """ Like compute_fraction(), but expensive computations run on the compute executor, if one is set. """
+        with metrics.timed(COMPUTE_SECONDS, number=self.name, digits=get_precision_bucket(amount)):
+            if _executor is None:
+                return self.compute_fraction(amount)
+            return _executor.run(amount, compute_fraction_in_process, self, amount, MpMathNumbers.backend)
 
     def get_next_digits_for_txt_file(self, amount: int, txt_path: str) -> str:
-        with open(txt_path, "a+") as f:
-            f.seek(0)
-            current_number_of_digits = len(f.readline()) - 2
-            if current_number_of_digits < 0:
-                current_number_of_digits = 0
-            next_digits = self.get_digits(current_number_of_digits, amount)
+        # The lock is held until the file is closed, so other processes see the cursor behind these digits
+        with file_lock(txt_path), open(txt_path, "a") as f:
+            next_digits = self.get_digits(self.get_txt_cursor(f.fileno()), amount)
             f.write(next_digits)
             return next_digits
 
-    def get_digits_for_user(self, user: str, amount: int, db_path: str) -> str:
-        conn = create_connection(db_path)
-        current_index = db_get_current_index(conn, user, self.name)
-        if current_index < 0:
-            return "error: user not found"
-        last_ten = self.get_digits(current_index, amount)
-        db_raise_current_index(conn, user, self.name, amount)
-        return last_ten
+    def get_txt_cursor(self, txt_file) -> int:
+        """ Returns the number of digits after the decimal point in a txt file like "3.14159", without reading it.
+            :param txt_file: path or file descriptor of the txt file
+            """
+        try:
+            # The file starts with the integer part and the point
+            return max(os.stat(txt_file).st_size - len(self.first_digit) - 1, 0)
+        except FileNotFoundError:
+            return 0
 
     @staticmethod
-    def get_all_from_file(txt_path):
-        with open(txt_path, "a+") as f:
-            f.seek(0)
-            line = f.readline()
-            if len(line) == 0:
-                return ""
-            return line
+    def reset_txt_file(txt_path: str):
+        with file_lock(txt_path), open(txt_path, "w"):
+            pass
+
+    def get_digits_for_user(self, user: str, amount: int, conn) -> str:
+        # The index is raised first, so concurrent requests of the same user get different digits
+        raised_index = db_raise_current_index(conn, user, self.name, amount)
+        if raised_index < 0:
+            return "error: user not found"
+        try:
+            return self.get_digits(raised_index - amount, amount)
+        except BaseException:
+            db_raise_current_index(conn, user, self.name, -amount)  # The user did not get these digits
+            raise
+
+
+_mpmath_contexts = threading.local()
+
+
+def get_mpmath_context():
+    """ Returns the mpmath context of the current thread. """
+    ctx = getattr(_mpmath_contexts, "ctx", None)
+    if ctx is None:
+        ctx = mpmath.MPContext()
+        _mpmath_contexts.ctx = ctx
+    return ctx
 
 
 class MpMathNumbers(IrrationalDigits):
+    backend = BACKEND_MPMATH
+    engine = None
+    # mpmath caches constants like pi in one place for all contexts. Reading and renewing
+    # this cache from several threads at once is not safe, so constants bring their own lock.
+    mpmath_lock = nullcontext()
+
     @staticmethod
     @abstractmethod
-    def get_mp_math_number():
+    def get_mp_math_number(ctx):
         pass
 
     def get_number_with_accuracy(self, accuracy) -> str:
         if int(accuracy) == 0:  # Special case for first digit before "."
             return self.first_digit
-        mpmath.mp.dps = accuracy + 2  # +2 for rounding
-        i_num = str(self.get_mp_math_number())
-        i_num = i_num.ljust(accuracy + 3, "0")
+        if self.backend == BACKEND_NATIVE and self.engine is not None:
+            return self.engine.get_number_with_accuracy(int(accuracy))
+        ctx = get_mpmath_context()
+        ctx.dps = accuracy + len(self.first_digit) + 1  # +1 for rounding
+        with self.mpmath_lock:
+            i_num = str(self.get_mp_math_number(ctx))
+        i_num = i_num.ljust(accuracy + len(self.first_digit) + 2, "0")
         return str(i_num)[:-1]
 
 
 class Pi(MpMathNumbers):
     name = "pi"
     first_digit = "3"
+    engine = ChudnovskyPi()
+    mpmath_lock = threading.Lock()
 
     @staticmethod
-    def get_mp_math_number():
-        return mpmath.mp.pi
+    def get_mp_math_number(ctx):
+        return ctx.pi
 
 
 class E(MpMathNumbers):
     name = "e"
     first_digit = "2"
+    engine = SeriesE()
+    mpmath_lock = threading.Lock()
 
     @staticmethod
-    def get_mp_math_number():
-        return mpmath.mp.e
+    def get_mp_math_number(ctx):
+        return ctx.e
 
 
 class Sqrt2(MpMathNumbers):
     name = "sqrt2"
     first_digit = "1"
+    engine = get_root_engine(2, 2)
 
     @staticmethod
-    def get_mp_math_number():
-        return mpmath.mp.sqrt(2)
+    def get_mp_math_number(ctx):
+        return ctx.sqrt(2)
+
+
+class Root(MpMathNumbers):
+    def __init__(self, radicand: int, degree: int = 2):
+        if not 0 < radicand <= MAX_RADICAND or degree not in ROOT_DEGREES.values():
+            raise ValueError(f"No root of degree {degree} for {radicand}")
+        self.radicand = radicand
+        self.degree = degree
+        self.name = next(prefix for prefix, d in ROOT_DEGREES.items() if d == degree) + str(radicand)
+        self.engine = get_root_engine(radicand, degree)
+        self.first_digit = str(self.engine.integer_part)
+
+    def __reduce__(self):  # The engine is not sent to other processes, they use their own engines
+        return Root, (self.radicand, self.degree)
+
+    @property
+    def digit_store(self):
+        # Anyone can request millions of different roots, so they get no files and open no mmaps.
+        # Their digits are only kept in the expansion cache, which is limited by its budget.
+        return None
+
+    def get_mp_math_number(self, ctx):
+        return ctx.root(self.radicand, self.degree)
+
+
+def set_backend(backend):
+    """ Selects the backend for all numbers: BACKEND_MPMATH or BACKEND_NATIVE """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}. Choose one of {BACKENDS}.")
+    MpMathNumbers.backend = backend
+
+
+def set_executor(executor, wait=False):
+    """ Selects the ComputeExecutor for expensive computations. None computes in the calling thread.
+        :param wait: wait until the processes of the former executor have ended
+        """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait)
+    _executor = executor
+
+
+def compute_fraction_in_process(number, amount, backend):
+    # Entry point in the processes of the compute executor, which don't know the backend of the web server
+    set_backend(backend)
+    return number.compute_fraction(amount)
+
+
+def set_cache_budget(budget):
+    """ Replaces the expansion cache by an empty one with the given budget in bytes. 0 disables the cache. """
+    global _cache
+    _cache = ExpansionCache(budget)
+
+
+def get_cache_stats():
+    """ Returns the hit, miss and eviction counters and the size of the expansion cache. """
+    return _cache.get_stats()
+
+
+def collect_cache_metrics():
+    stats = _cache.get_stats()
+    return [("pithon_expansion_cache_requests_total", "counter", "Requests to the expansion cache",
+             [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+            ("pithon_expansion_cache_evictions_total", "counter", "Numbers evicted from the expansion cache",
+             [({}, stats["evictions"])]),
+            ("pithon_expansion_cache_digits", "gauge", "Digits in the expansion cache", [({}, stats["size"])])]
+
+
+metrics.add_collector(collect_cache_metrics)
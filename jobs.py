@@ -0,0 +1,181 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+
+from compute_executor import ComputeExecutor
+from database import db_create_job, db_count_jobs, db_get_job, db_get_unfinished_job_ids, db_set_job_state, \
+    db_delete_jobs_finished_before, JOB_COMPUTING, JOB_WRITING, JOB_DONE, JOB_FAILED
+from irrational_digits import MpMathNumbers, compute_fraction_in_process
+
+# Huge amounts of digits are computed as jobs in the background, so no HTTP connection has to wait for them.
+# The state of every job is kept in the table "jobs", so unfinished jobs are continued after a restart.
+# Jobs run one after another on their own process, without the timeout of the web requests.
+# The result is written to a file, which is deleted together with the job after the expiry.
+# Jobs are limited in total (queued and kept results) and per client (unfinished ones), so neither the queue
+# nor the result folder can grow without bounds.
+
+DEFAULT_JOB_EXPIRY = 24 * 60 * 60  # seconds a finished job is kept
+DEFAULT_JOB_MAX_DIGITS = 100000000  # digits after the decimal point a job may read up to
+DEFAULT_MAX_JOBS = 100  # jobs queued, running or done and not expired yet
+DEFAULT_JOBS_PER_CLIENT = 2  # unfinished jobs of one client
+JOB_RETRY_AFTER = 60  # seconds
+JOB_TIMEOUT = 24 * 60 * 60  # seconds
+CLEANUP_INTERVAL = 60  # seconds between two looks for expired jobs, when no job is waiting
+WRITE_BLOCK_SIZE = 1024 * 1024  # digits, the progress is saved after every block
+
+_runner = None
+
+
+class JobLimitError(RuntimeError):
+    def __init__(self, message, retry_after=JOB_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_job_id(number, radicand, index, amount):
+    """ Equal jobs get the same id, so they are computed only once. """
+    return hashlib.sha256(f"{number}-{radicand}-{index}-{amount}".encode()).hexdigest()[:32]
+
+
+class JobRunner:
+    def __init__(self, conn, folder, create_number, expiry=DEFAULT_JOB_EXPIRY, max_jobs=DEFAULT_MAX_JOBS,
+                 jobs_per_client=DEFAULT_JOBS_PER_CLIENT):
+        """
+        :param conn: database with the table "jobs"
+        :param folder: the results are saved here
+        :param create_number: returns the number instance for the number and the radicand of a job
+        :param expiry: seconds a finished job and its result are kept
+        :param max_jobs: jobs queued, running or done and not expired yet
+        :param jobs_per_client: unfinished jobs a client may have
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.conn = conn
+        self.folder = folder
+        self.create_number = create_number
+        self.expiry = expiry
+        self.max_jobs = max_jobs
+        self.jobs_per_client = jobs_per_client
+        self._executor = ComputeExecutor(processes=1, queue_depth=1, timeout=JOB_TIMEOUT)
+        self._queue = queue.Queue()
+        self._queued = set()  # Ids in the queue, so a job is not queued twice
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """ Continues the jobs, which were not finished before the last stop, and starts the next ones. """
+        for job_id in db_get_unfinished_job_ids(self.conn):
+            self._enqueue(job_id)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._executor.shutdown()
+
+    def submit(self, number, radicand, index, amount, client=None):
+        """ Returns the job for these digits. It is created, if it does not exist or failed before.
+            Raises JobLimitError, if there are too many jobs or client has too many unfinished jobs.
+            """
+        job_id = get_job_id(number, radicand, index, amount)
+        with self._submit_lock:  # Jobs are counted and created at once
+            job = self.get_job(job_id)
+            if job is None or job["state"] == JOB_FAILED:
+                jobs, client_jobs = db_count_jobs(self.conn, client)
+                if jobs >= self.max_jobs:
+                    raise JobLimitError("Too many jobs. Please try again later.")
+                if client_jobs >= self.jobs_per_client:
+                    raise JobLimitError(f"At most {self.jobs_per_client} unfinished jobs per client. "
+                                        f"Please try again later.")
+            if db_create_job(self.conn, job_id, number, radicand, index, amount, time.time(), client):
+                self._enqueue(job_id)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id):
+        """ Returns the job as dict or None, if it does not exist or expired. """
+        job = db_get_job(self.conn, job_id)
+        if job is not None and job["finished"] is not None:
+            job["expires"] = job["finished"] + self.expiry
+        return job
+
+    def get_result_path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.txt")
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        self._queue.put(job_id)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                job_id = self._queue.get(timeout=min(CLEANUP_INTERVAL, max(self.expiry, 1)))
+            except queue.Empty:
+                job_id = None
+            if self._stopped.is_set():
+                break
+            if job_id is not None:
+                self.run_job(job_id)
+                with self._lock:
+                    self._queued.discard(job_id)
+            self.delete_expired_jobs()
+
+    def run_job(self, job_id):
+        job = db_get_job(self.conn, job_id)
+        if job is None or job["state"] in (JOB_DONE, JOB_FAILED):
+            return
+        try:
+            number = self.create_number(job["number"], job["radicand"])
+            self._write_result(job, number)
+            db_set_job_state(self.conn, job_id, JOB_DONE, 1.0, finished=time.time())
+        except Exception as err:
+            if self._stopped.is_set():
+                return  # Interrupted by the stop, the job is continued after the next start
+            if os.path.exists(f"{self.get_result_path(job_id)}.part"):
+                os.remove(f"{self.get_result_path(job_id)}.part")
+            db_set_job_state(self.conn, job_id, JOB_FAILED, error=str(err) or repr(err), finished=time.time())
+
+    def _write_result(self, job, number):
+        """ Writes the digits of the job like IrrationalDigits.get_digits() returns them. """
+        start, end = job["start_index"], job["start_index"] + job["amount"]
+        if number.get_available_digits() >= end:
+            read_fraction = number.get_fraction
+        else:
+            db_set_job_state(self.conn, job["job_id"], JOB_COMPUTING)
+            fraction = self._executor.run(end, compute_fraction_in_process, number, end, MpMathNumbers.backend)
+            if number.digit_store is not None:
+                number.digit_store.extend(fraction)  # Following requests read these digits from the store
+
+            def read_fraction(block_start, block_end):
+                return fraction[block_start:block_end]
+
+        db_set_job_state(self.conn, job["job_id"], JOB_WRITING)
+        path = self.get_result_path(job["job_id"])
+        with open(f"{path}.part", "w") as f:  # Renamed when complete, so no partial result can be downloaded
+            if start == 0:
+                f.write(number.first_digit + ("." if end > 0 else ""))
+            for block_start in range(start, end, WRITE_BLOCK_SIZE):
+                block_end = min(block_start + WRITE_BLOCK_SIZE, end)
+                f.write(read_fraction(block_start, block_end))
+                db_set_job_state(self.conn, job["job_id"], JOB_WRITING, (block_end - start) / (end - start))
+        os.replace(f"{path}.part", path)
+
+    def delete_expired_jobs(self):
+        for job_id in db_delete_jobs_finished_before(self.conn, time.time() - self.expiry):
+            if os.path.exists(self.get_result_path(job_id)):
+                os.remove(self.get_result_path(job_id))
+
+
+def set_job_runner(runner):
+    """ Stops the running job runner and starts the given one. None only stops it. """
+    global _runner
+    if _runner is not None:
+        _runner.stop()
+    _runner = runner
+    if runner is not None:
+        runner.start()
@@ -0,0 +1,136 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+# Counters and latency histograms of the hot paths, exported in the Prometheus text format.
+# Metrics are off by default. Then every instrumented call only checks the flag `enabled`.
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)  # seconds
+
+enabled = False
+_metrics = {}
+_collectors = []
+
+
+def set_metrics_enabled(on):
+    global enabled
+    enabled = bool(on)
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    # Whitespace is collapsed, so multi-line SQL statements can be labels
+    escaped = (" ".join(str(value).split()).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{label_text(key)} {value}" for key, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._values = {}  # labels -> [count per bucket..., count above all buckets, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[bisect.bisect_left(self.buckets, value)] += 1
+            values[-1] += value
+
+    def get_count(self, **labels):
+        values = self._values.get(tuple(sorted(labels.items())))
+        return sum(values[:-1]) if values is not None else 0
+
+    def render(self):
+        lines = []
+        with self._lock:
+            all_values = [(key, list(values)) for key, values in self._values.items()]
+        for key, values in all_values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{label_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(key)} {values[-1]}")
+            lines.append(f"{self.name}_count{label_text(key)} {cumulative}")
+        return lines
+
+
+def counter(name, description):
+    return _metrics.setdefault(name, Counter(name, description))
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return _metrics.setdefault(name, Histogram(name, description, buckets))
+
+
+def add_collector(collect):
+    """ collect() is called on every export and returns [(name, kind, description, [(labels dict, value)])].
+        Used for values counted elsewhere anyway, like the statistics of the expansion cache.
+        """
+    _collectors.append(collect)
+
+
+class Timer:
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.start, **self.labels)
+
+
+_no_timer = nullcontext()
+
+
+def timed(metric, **labels):
+    """ Returns a context manager observing the seconds spent in its with block, if metrics are enabled. """
+    if not enabled:
+        return _no_timer
+    return Timer(metric, labels)
+
+
+def render():
+    """ Returns all metrics in the Prometheus text format. """
+    lines = []
+    for metric in _metrics.values():
+        lines += [f"# HELP {metric.name} {metric.description}", f"# TYPE {metric.name} {metric.kind}"]
+        lines += metric.render()
+    for collect in _collectors:
+        for name, kind, description, samples in collect():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{label_text(tuple(sorted(labels.items())))} {value}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,94 @@
+import threading
+import time
+
+# Users read forward from their current index, so the digit store is extended ahead of them in the background.
+# Then the requests of the users almost never have to wait for a computation.
+
+DEFAULT_MARGIN = 10000  # digits ahead of the furthest user, 0 disables the worker
+DEFAULT_MAX_DEPTH = 1000000  # digits
+DEFAULT_CPU_SHARE = 0.25  # share of the time the worker may spend computing
+DEFAULT_INTERVAL = 5  # seconds between two looks at the watermarks
+
+_worker = None
+
+
+class PrecomputeWorker:
+    def __init__(self, numbers, get_watermarks, margin=DEFAULT_MARGIN, max_depth=DEFAULT_MAX_DEPTH,
+                 cpu_share=DEFAULT_CPU_SHARE, interval=DEFAULT_INTERVAL):
+        """
+        :param numbers: instances of the numbers to precompute
+        :param get_watermarks: returns {number name: furthest index read by anyone}
+        :param margin: digits to keep in the digit store beyond the watermark
+        :param max_depth: the store is never extended beyond this digit by the worker
+        :param cpu_share: after computing for t seconds, the worker pauses for t * (1 - cpu_share) / cpu_share
+        :param interval: seconds to wait, when there is nothing to compute
+        """
+        if not 0 < cpu_share <= 1:
+            raise ValueError("cpu_share must be in (0, 1].")
+        self.numbers = numbers
+        self.get_watermarks = get_watermarks
+        self.margin = margin
+        self.max_depth = max_depth
+        self.cpu_share = cpu_share
+        self.interval = interval
+        self.status = {number.name: {"watermark": 0, "target": 0, "stored": 0, "computations": 0,
+                                     "last_duration": 0.0, "error": None} for number in numbers}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run_once(self):
+        """ Extends the store of every number up to its target. Returns the seconds spent computing. """
+        watermarks = self.get_watermarks()
+        busy = 0.0
+        for number in self.numbers:
+            store = number.digit_store
+            if store is None or self._stopped.is_set():
+                continue
+            status = self.status[number.name]
+            status["watermark"] = watermarks.get(number.name, 0)
+            status["target"] = min(status["watermark"] + self.margin, self.max_depth)
+            status["stored"] = len(store)
+            if status["stored"] >= status["target"]:
+                continue
+            start = time.perf_counter()
+            try:
+                number.extend_store(status["target"])
+                status["error"] = None
+            except Exception as err:  # e.g. ComputeBusyError, the worker tries again next time
+                status["error"] = repr(err)
+            duration = time.perf_counter() - start
+            busy += duration
+            status["computations"] += 1
+            status["last_duration"] = duration
+            status["stored"] = len(store)
+        return busy
+
+    def _run(self):
+        while not self._stopped.is_set():
+            busy = self.run_once()
+            pause = busy * (1 - self.cpu_share) / self.cpu_share if busy > 0 else self.interval
+            self._stopped.wait(pause)
+
+
+def set_worker(worker):
+    """ Stops the running precompute worker and starts the given one. None only stops it. """
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+    _worker = worker
+    if worker is not None:
+        worker.start()
+
+
+def get_worker_status():
+    """ Returns the status of every number of the running worker and its settings, or None without worker. """
+    if _worker is None:
+        return None
+    return {"numbers": _worker.status, "margin": _worker.margin, "max_depth": _worker.max_depth,
+            "cpu_share": _worker.cpu_share}
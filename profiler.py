@@ -0,0 +1,118 @@
+import cProfile
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# Profiling of single requests, switched on and off by admins at runtime.
+# A share of the requests (or every request with the url parameter "profile") runs under cProfile and tracemalloc.
+# Their profiles are saved as pstats files. Slow requests are written to a rotating log.
+# Only one request at a time is profiled: since Python 3.12 cProfile can't run twice in a process.
+# Sampled requests arriving meanwhile are not profiled. tracemalloc traces the whole process,
+# so the peak of a request includes concurrent requests.
+
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_SLOW_THRESHOLD = 1.0  # seconds
+DEFAULT_MAX_PROFILES = 50  # kept on disk, older ones are deleted
+TOP_FUNCTIONS = 15
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+HIDDEN_PARAMETERS = {"password"}
+
+
+class RequestProfiler:
+    def __init__(self, folder, enabled=False, sample_rate=DEFAULT_SAMPLE_RATE, slow_threshold=DEFAULT_SLOW_THRESHOLD,
+                 max_profiles=DEFAULT_MAX_PROFILES):
+        """
+        :param folder: the profiles and the slow log are saved here
+        :param sample_rate: share of requests to profile
+        :param slow_threshold: requests taking longer (in seconds) are written to the slow log
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.profiles = deque(maxlen=max_profiles)  # Newest last
+        self.slow_log_path = os.path.join(folder, "slow_requests.log")
+        self._slow_log = logging.getLogger(f"pithon.slow_requests.{id(self)}")
+        self._slow_log.propagate = False
+        self._slow_log.addHandler(RotatingFileHandler(self.slow_log_path, maxBytes=SLOW_LOG_BYTES,
+                                                      backupCount=SLOW_LOG_BACKUPS))
+        self._slow_log.setLevel(logging.INFO)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()  # Held while a request is profiled
+
+    def get_settings(self):
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "slow_threshold": self.slow_threshold}
+
+    def set_settings(self, enabled=None, sample_rate=None, slow_threshold=None):
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1.")
+        if slow_threshold is not None and slow_threshold < 0:
+            raise ValueError("slow_threshold must not be negative.")
+        self.enabled = self.enabled if enabled is None else bool(enabled)
+        self.sample_rate = self.sample_rate if sample_rate is None else sample_rate
+        self.slow_threshold = self.slow_threshold if slow_threshold is None else slow_threshold
+
+    def start(self, forced=False):
+        """ Starts a measurement of the current request. Returns None, if profiling is off.
+            :param forced: profile the request in any case, otherwise only a sample of requests is profiled
+            """
+        if not self.enabled:
+            return None
+        measurement = {"start": time.perf_counter(), "profile": None}
+        if (forced or random.random() < self.sample_rate) and self._profiling.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # Another profiling tool is active
+                self._profiling.release()
+                return measurement
+            tracemalloc.start()
+            measurement["profile"] = profile
+        return measurement
+
+    def stop(self, measurement, method, path, parameters, status):
+        """ Ends the measurement. Saves the profile and writes the request to the slow log, if it was slow. """
+        duration = time.perf_counter() - measurement["start"]
+        profile = measurement["profile"]
+        entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "method": method, "path": path,
+                 "parameters": {key: value for key, value in parameters.items() if key not in HIDDEN_PARAMETERS},
+                 "status": status, "duration": round(duration, 6)}
+        if profile is not None:
+            profile.disable()
+            entry["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._profiling.release()
+            entry["id"] = f"{int(time.time())}-{next(self._ids)}"
+            profile.dump_stats(self.get_profile_path(entry["id"]))
+            entry["top_functions"] = get_top_functions(profile)
+            with self._lock:
+                if len(self.profiles) == self.profiles.maxlen:
+                    os.remove(self.get_profile_path(self.profiles[0]["id"]))
+                self.profiles.append({key: entry[key] for key in ["id", "time", "method", "path", "duration"]})
+        if duration >= self.slow_threshold:
+            self._slow_log.info(json.dumps(entry))
+
+    def get_profile_path(self, profile_id):
+        return os.path.join(self.folder, f"{profile_id}.prof")
+
+
+def get_top_functions(profile, amount=TOP_FUNCTIONS):
+    """ Returns the amount functions with the most cumulative time like "file:line(function) 0.123s". """
+    stats = pstats.Stats(profile, stream=io.StringIO()).sort_stats(pstats.SortKey.CUMULATIVE)
+    top_functions = []
+    for function in stats.fcn_list[:amount]:
+        cumulative_time = stats.stats[function][3]
+        top_functions.append(f"{pstats.func_std_string(function)} {cumulative_time:.6f}s")
+    return top_functions
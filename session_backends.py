@@ -0,0 +1,86 @@
+import threading
+from datetime import datetime
+
+from cachelib import SimpleCache
+from flask_session import Session
+from flask_session.sessions import FileSystemSessionInterface
+from flask_sqlalchemy import SQLAlchemy
+
+# Backends for the flask session, selected with SESSION_BACKEND in the config of create_app():
+# "memory":     sessions are kept in a cachelib SimpleCache of the process, expired sessions are dropped by the cache.
+#               Fastest, but every server process has its own sessions and they are lost on restart.
+# "cookie":     the session data is kept in a cookie signed with the SECRET_KEY (the default of flask).
+#               Anyone knowing the key can forge sessions, so it needs a secret SECRET_KEY of its own,
+#               given in the config or the environment variable PITHON_SECRET_KEY.
+# "sqlalchemy": sessions are saved in SQLite by Flask-Session, expired rows are deleted in the background.
+
+SESSION_MEMORY = "memory"
+SESSION_COOKIE = "cookie"
+SESSION_SQLALCHEMY = "sqlalchemy"
+SESSION_BACKENDS = [SESSION_MEMORY, SESSION_COOKIE, SESSION_SQLALCHEMY]
+DEFAULT_MEMORY_SESSIONS = 10000  # sessions kept by the memory backend before the oldest are dropped
+DEFAULT_CLEANUP_INTERVAL = 60 * 60  # seconds between two deletions of expired sessions
+PUBLIC_SECRET_KEY = "PiThon"  # Default key from the source code, it protects nothing
+MIN_SECRET_KEY_LENGTH = 16
+
+_cleanup_stopped = None
+
+
+class MemorySessionInterface(FileSystemSessionInterface):
+    """ The filesystem sessions of Flask-Session, but with a cache in memory instead of files. """
+
+    def __init__(self, threshold=DEFAULT_MEMORY_SESSIONS, key_prefix="session:", use_signer=False, permanent=True):
+        self.cache = SimpleCache(threshold=threshold)
+        self.key_prefix = key_prefix
+        self.use_signer = use_signer
+        self.permanent = permanent
+        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+
+
+def init_session(app, backend):
+    """ Sets up the session backend of app. """
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend {backend}. Choose one of {SESSION_BACKENDS}.")
+    if backend == SESSION_COOKIE and (not app.secret_key or app.secret_key == PUBLIC_SECRET_KEY
+                                      or len(app.secret_key) < MIN_SECRET_KEY_LENGTH):
+        raise ValueError(f"Cookie sessions need a secret SECRET_KEY of at least {MIN_SECRET_KEY_LENGTH} characters.")
+    if backend == SESSION_MEMORY:
+        app.session_interface = MemorySessionInterface()
+    elif backend == SESSION_SQLALCHEMY:
+        app.config["SESSION_TYPE"] = "sqlalchemy"
+        db = app.config["SESSION_SQLALCHEMY"] = SQLAlchemy(app)
+        Session(app)
+        with app.app_context():
+            db.create_all()
+    # SESSION_COOKIE keeps the SecureCookieSessionInterface of flask
+
+
+def delete_expired_sessions(app):
+    """ Deletes the expired rows of the sqlalchemy sessions. Returns how many were deleted. """
+    model = app.session_interface.sql_session_model
+    with app.app_context():
+        deleted = model.query.filter(model.expiry <= datetime.utcnow()).delete()
+        app.session_interface.db.session.commit()
+    return deleted
+
+
+def set_session_cleanup(app, interval=DEFAULT_CLEANUP_INTERVAL):
+    """ Stops the cleanup of the former app and deletes the expired sessions of app every interval seconds.
+        app None only stops the cleanup.
+        """
+    global _cleanup_stopped
+    if _cleanup_stopped is not None:
+        _cleanup_stopped.set()
+    _cleanup_stopped = None
+    if app is None:
+        return
+    stopped = _cleanup_stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                delete_expired_sessions(app)
+            except Exception as err:  # e.g. a locked database, the next run tries again
+                print(f"Error in session cleanup: {err}")
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,61 @@
+import threading
+
+# Coalesces concurrent computations of the same number.
+# Only one computation per key runs at a time. Requests needing at most the precision of the running
+# computation wait for its result. Requests needing more raise its target, so the computation is repeated
+# with the raised target once it finishes, instead of a second computation starting next to it.
+
+
+class _Flight:
+    def __init__(self, target):
+        self.target = target
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class SingleFlight:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._flights = {}
+        self.computations = 0  # Number of computations really started, for tests and statistics
+
+    def run(self, key, target, compute):
+        """ Returns compute(t) for a t >= target, sharing the computation with concurrent callers of the same key.
+            :param key: name of the computed number
+            :param target: precision needed by the caller
+            :param compute: function computing a result with len(result) == t for a precision t
+            """
+        with self._condition:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.target = max(flight.target, target)
+                while not flight.done and (flight.result is None or len(flight.result) < target):
+                    self._condition.wait()
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            flight = _Flight(target)
+            self._flights[key] = flight
+
+        try:
+            while True:
+                with self._condition:
+                    current_target = flight.target
+                    self.computations += 1
+                result = compute(current_target)
+                with self._condition:
+                    flight.result = result
+                    if flight.target <= current_target:
+                        flight.done = True
+                        del self._flights[key]
+                        self._condition.notify_all()
+                        return result
+                    self._condition.notify_all()  # Serves the waiters, which don't need the raised target
+        except BaseException as err:
+            with self._condition:
+                flight.error = err
+                flight.done = True
+                del self._flights[key]
+                self._condition.notify_all()
+            raise
@@ -4,7 +4,7 @@ import pytest
 from werkzeug.security import check_password_hash
 
 from database import TEST_USER_STD, TEST_USER_ADMIN, db_get_password, create_connection
-from test_api import PI_FIRST_10, E_FIRST_10, SQRT2_FIRST_10
+from test_api import PI_FIRST_10, E_FIRST_10, E_NEXT_10, SQRT2_FIRST_10
 from web import CONFIG_DB_PATH
 
 status = http.HTTPStatus
@@ -69,3 +69,16 @@ def test_admin_can_reset_all_user_indices(client_with_test_user):
     assert client.get(f"api/user?number=pi&amount=10", auth=TEST_USER_STD).data == PI_FIRST_10
     assert client.get(f"api/user?number=e&amount=10", auth=TEST_USER_STD).data == E_FIRST_10
     assert client.get(f"api/user?number=sqrt2&amount=10", auth=("test_user", "test_password")).data == SQRT2_FIRST_10
+
+
+def test_admin_can_raise_many_indices(client_with_test_user):
+    client = client_with_test_user
+    increments = [{"username": "test_user", "number": "pi", "increment": 10},
+                  {"username": TEST_USER_STD[0], "number": "e", "increment": 10}]
+    assert client.post("admin/indices", auth=TEST_USER_STD, json=increments).status_code == status.FORBIDDEN
+    response = client.post("admin/indices", auth=TEST_USER_ADMIN, json=increments)
+    assert response.status_code == status.OK
+    assert response.json == [10, 10]
+    assert client.get(f"api/user?number=e&amount=10", auth=TEST_USER_STD).data == E_NEXT_10
+    assert client.post("admin/indices", auth=TEST_USER_ADMIN, json=[{"username": "test_user"}]).status_code == \
+        status.BAD_REQUEST
@@ -0,0 +1,98 @@
+import http
+import time
+
+import pytest
+
+from admission_control import AdmissionController, OverBudgetError, CostTooHighError, HEAVY_RETRY_AFTER
+from database import TEST_USER_STD
+from web import create_app, CONFIG_ADMISSION_CAPACITY, CONFIG_ADMISSION_REFILL_RATE, CONFIG_PRECOMPUTE_MARGIN, \
+    CONFIG_ADMISSION_MAX_COST, CONFIG_COMPUTE_TIMEOUT, CONFIG_COMPUTE_THRESHOLD, CONFIG_HEAVY_COMPUTATION_COST, \
+    CONFIG_MAX_HEAVY_COMPUTATIONS
+
+status = http.HTTPStatus
+
+
+def test_buckets_are_charged_by_cost():
+    admission = AdmissionController(capacity=1000, refill_rate=1)
+    assert not admission.admit(["ip:a", "user:a"], 600)
+    with pytest.raises(OverBudgetError) as err:
+        admission.admit(["ip:a"], 600)
+    assert err.value.retry_after == 200
+    admission.admit(["ip:b"], 600)  # Other clients have their own buckets
+    with pytest.raises(OverBudgetError):
+        admission.admit(["ip:b", "user:a"], 600)
+    admission.admit(["ip:a", "user:a"], 0)  # Available digits cost nothing
+
+
+def test_costs_above_capacity_are_refused():
+    admission = AdmissionController(capacity=1000, refill_rate=1)
+    with pytest.raises(CostTooHighError):
+        admission.admit(["ip:a"], 1001)
+    assert not admission.admit(["ip:a"], 1000)  # A full bucket was left
+    with pytest.raises(CostTooHighError):
+        AdmissionController().admit(["ip:x"], 10 ** 9)
+
+
+def test_heavy_computations_are_limited():
+    admission = AdmissionController(heavy_cost=100, max_heavy=1)
+    assert admission.admit(["ip:a"], 100)
+    with pytest.raises(OverBudgetError) as err:
+        admission.admit(["ip:b"], 100)
+    assert err.value.retry_after == HEAVY_RETRY_AFTER
+    assert not admission.admit(["ip:b"], 99)
+    admission.release_heavy()
+    assert admission.admit(["ip:b"], 100)
+
+
+def test_requests_over_budget_get_429(tmp_path):
+    client = create_app(tmp_path, {CONFIG_ADMISSION_CAPACITY: 3000, CONFIG_ADMISSION_REFILL_RATE: 1,
+                                   CONFIG_PRECOMPUTE_MARGIN: 0}).test_client()
+    assert client.get("/api?number=e&index=0&amount=2000").status_code == status.OK
+    assert client.get("/api?number=e&index=5&amount=1995").status_code == status.OK  # Available digits
+    response = client.get("/api?number=e&index=2500&amount=10")
+    assert response.status_code == status.TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) > 1000
+    assert client.get("/api?number=e&index=2500&amount=10",
+                      environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == status.OK
+
+    # The budget of a user is shared by all their clients
+    assert client.get("/api/user?number=sqrt2&amount=2500", auth=TEST_USER_STD,
+                      environ_base={"REMOTE_ADDR": "10.0.0.3"}).status_code == status.OK
+    assert client.get("/api/user?number=sqrt2&amount=400", auth=TEST_USER_STD,
+                      environ_base={"REMOTE_ADDR": "10.0.0.4"}).status_code == status.TOO_MANY_REQUESTS
+    assert client.get("/api/user?number=sqrt2", auth=TEST_USER_STD).text.startswith("1.41421")
+
+    response = client.get("/api?number=pi&index=0&amount=3001", environ_base={"REMOTE_ADDR": "10.0.0.5"})
+    assert response.status_code == status.REQUEST_ENTITY_TOO_LARGE and "/api/jobs" in response.text
+
+
+def test_db_digits_are_admitted(tmp_path):
+    client = create_app(tmp_path, {CONFIG_ADMISSION_CAPACITY: 15000, CONFIG_ADMISSION_REFILL_RATE: 1,
+                                   CONFIG_PRECOMPUTE_MARGIN: 0}).test_client()
+    assert client.get("/db/e/100000000").status_code == status.REQUEST_ENTITY_TOO_LARGE
+    assert client.get("/db/e/5000").status_code == status.OK  # Computes the first 2 blocks (8191 digits)
+    assert client.get("/db/e/8000").status_code == status.OK  # Saved in the blocks already
+    assert client.get("/db/e/9000").status_code == status.TOO_MANY_REQUESTS
+
+
+def test_costs_have_to_fit_into_the_compute_timeout(tmp_path):
+    client = create_app(tmp_path, {CONFIG_COMPUTE_TIMEOUT: 0.5, CONFIG_PRECOMPUTE_MARGIN: 0}).test_client()
+    for url in ["/api?number=pi&index=0&amount=100000", "/api/stream?number=sqrt&n=3&amount=100000"]:
+        assert client.get(url).status_code == status.REQUEST_ENTITY_TOO_LARGE
+    assert client.get("/api?number=pi&index=0&amount=1000").status_code == status.OK
+
+
+def test_heavy_slot_is_kept_until_the_computation_ends(tmp_path):
+    client = create_app(tmp_path, {CONFIG_COMPUTE_TIMEOUT: 0.05, CONFIG_COMPUTE_THRESHOLD: 1000,
+                                   CONFIG_HEAVY_COMPUTATION_COST: 1000, CONFIG_MAX_HEAVY_COMPUTATIONS: 1,
+                                   CONFIG_ADMISSION_MAX_COST: 10 ** 6, CONFIG_PRECOMPUTE_MARGIN: 0}).test_client()
+    # The pool starts its process first, so the computation goes on after the timeout of the request
+    assert client.get("/api?number=e&index=0&amount=5000").status_code == status.GATEWAY_TIMEOUT
+    response = client.get("/api?number=pi&index=0&amount=5000", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert response.status_code == status.TOO_MANY_REQUESTS
+    for _ in range(100):
+        time.sleep(0.1)
+        response = client.get("/api?number=sqrt2&index=0&amount=5000", environ_base={"REMOTE_ADDR": "10.0.0.3"})
+        if response.status_code != status.TOO_MANY_REQUESTS:
+            break
+    assert response.status_code != status.TOO_MANY_REQUESTS
@@ -1,6 +1,10 @@
 import http
+from unittest import mock
+
 import pytest
 from database import TEST_USER_STD
+from irrational_digits import Pi, Root, STREAM_BLOCK_SIZE
+from web import create_app, CONFIG_PRECOMPUTE_MARGIN
 
 PI_FIRST_10 = b"3.1415926535"
 PI_NEXT_10 = b"8979323846"
@@ -22,6 +26,16 @@ def test_num_can_be_reset_without_auth(client, number, first_ten, next_ten):
     assert client.get(f"api?number={number}").data == b""
 
 
+def test_txt_cursor_follows_file_size(client, tmp_path):
+    assert Pi().get_txt_cursor(tmp_path / "pi.txt") == 0
+    for amount in [3, 0, 7, 1500]:
+        client.get(f"api?number=pi&amount={amount}")
+    assert Pi().get_txt_cursor(tmp_path / "pi.txt") == 1510
+    response = client.get("api?number=pi")
+    assert response.data.decode() == Pi().get_digits(0, 1510)
+    assert response.headers["Cache-Control"] == "no-store, max-age=0"
+
+
 @pytest.mark.parametrize("number,first_ten,next_ten", [("pi", PI_FIRST_10, PI_NEXT_10),
                                                        ("e", E_FIRST_10, E_NEXT_10),
                                                        ("sqrt2", SQRT2_FIRST_10, SQRT2_NEXT_10)])
@@ -54,6 +68,75 @@ def test_db_number_digit(client, endpoint, first_ten):
         assert client.get(f"/db{endpoint}/{i}").data == first_ten[i + 1:i + 2]
 
 
+@pytest.mark.parametrize("query,digits", [("number=sqrt&n=2&index=0&amount=10", SQRT2_FIRST_10),
+                                           ("number=sqrt&n=3&index=0&amount=10", b"1.7320508075"),
+                                           ("number=sqrt&n=150&index=0&amount=5", b"12.24744"),
+                                           ("number=cbrt&n=3&index=3&amount=5", b"24957"),
+                                           ("number=cbrt&n=27&index=0&amount=3", b"3.000")])
+def test_roots_of_n(client, query, digits):
+    assert client.get(f"api?{query}").data == digits
+
+
+@pytest.mark.parametrize("query", ["number=sqrt&index=0", "number=sqrt&n=0&index=0", "number=cbrt&n=a&index=0"])
+def test_roots_need_valid_n(client, query):
+    assert client.get(f"api?{query}").status_code == status.BAD_REQUEST
+
+
+def test_roots_leave_no_files(tmp_path):
+    # Without the precompute worker, which creates the stores of pi, e and sqrt2 in the background
+    client = create_app(tmp_path, {CONFIG_PRECOMPUTE_MARGIN: 0}).test_client()
+    files = set(tmp_path.rglob("*"))
+    for n in range(2, 50):
+        assert client.get(f"api?number=sqrt&n={n}&index=0&amount=5").status_code == status.OK
+    assert client.get("api?number=sqrt&n=150&amount=5").status_code == status.BAD_REQUEST
+    assert client.get("api?number=cbrt&n=3").status_code == status.BAD_REQUEST
+    assert set(tmp_path.rglob("*")) == files
+
+
+@pytest.mark.parametrize("query", ["number=pi&index=0&amount=0", "number=pi&index=0&amount=10", "number=e&amount=25",
+                                   "number=sqrt2&index=7&amount=30", "number=cbrt&n=5&index=3&amount=12"])
+def test_stream_returns_same_digits(client, query):
+    response = client.get(f"api/stream?{query}")
+    assert response.is_streamed
+    assert response.data == client.get(f"api?{query}&index=0" if "index" not in query else f"api?{query}").data
+
+
+def test_stream_reads_blocks(client):
+    blocks = list(Pi().iter_fraction(1500, 4200, block_size=1000))
+    assert [len(block) for block in blocks] == [1000, 1000, 700]
+    assert "".join(blocks).encode() == client.get("api?number=pi&index=1500&amount=2700").data
+
+
+def test_stream_computes_roots_once(client):
+    amount = 3 * STREAM_BLOCK_SIZE + 10
+    with mock.patch.object(Root, "compute_and_cache_fraction", autospec=True,
+                           side_effect=Root.compute_and_cache_fraction) as compute:
+        response = client.get(f"api/stream?number=sqrt&n=1234&amount={amount}")
+        assert len(response.data) == len("35.") + amount
+    assert compute.call_count == 2  # The first block, then all the others at once
+
+
+def test_stream_needs_amount(client):
+    assert client.get("api/stream?number=pi&index=5").status_code == status.BAD_REQUEST
+
+
+def test_batch_answers_queries_in_order(client):
+    queries = [{"number": "e", "index": 3, "amount": 5}, {"number": "pi", "index": 0, "amount": 10},
+               {"number": "pi", "index": 4}, {"number": "sqrt", "n": 3, "index": 0, "amount": 10},
+               {"number": "pi", "index": 2000, "amount": 10}, {"number": "sqrt2", "amount": 0}]
+    response = client.post("api/batch", json=queries)
+    assert response.status_code == status.OK
+    assert response.json == [client.get("api?number=e&index=3&amount=5").text, "3.1415926535", "5", "1.7320508075",
+                             Pi().get_digits(2000, 10), "1"]
+
+
+@pytest.mark.parametrize("queries", [{"number": "pi"}, [{"number": "tau"}], [{"number": "pi", "index": -1}],
+                                     [{"number": "pi", "amount": "10"}], [{"number": "sqrt", "n": 0}], ["pi"],
+                                     [{"number": "pi"}] * 1001])
+def test_batch_needs_valid_queries(client, queries):
+    assert client.post("api/batch", json=queries).status_code == status.BAD_REQUEST
+
+
 def test_users_can_be_created_and_deleted(client):
     tmp_user = "tmp_user"
     tmp_pw = "tmp_password"
@@ -69,3 +152,23 @@ def test_if_no_cache_is_set_correctly(client):
     assert client.get("/admin/users").headers['Cache-Control'] == "no-store, max-age=0"
 
 
+@pytest.mark.parametrize("url", ["api?number=pi&index=5&amount=13", "api?number=e&index=3", "db/sqrt2/4",
+                                 "api/stream?number=pi&index=0&amount=20", "api?number=cbrt&n=7&index=2&amount=5"])
+def test_immutable_digits_can_be_cached(client, url):
+    response = client.get(url)
+    assert response.status_code == status.OK
+    assert response.cache_control.public and response.cache_control.immutable
+    etag, weak = response.get_etag()
+    assert etag is not None and not weak
+
+    not_modified = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    assert not_modified.status_code == status.NOT_MODIFIED
+    assert not_modified.data == b""
+    assert client.get(url, headers={"If-None-Match": '"other"'}).data == response.data
+
+
+@pytest.mark.parametrize("url", ["api?number=pi", "api?number=pi&amount=10", "api/download?number=pi"])
+def test_mutable_digits_are_not_cached(client, url):
+    assert client.get(url).headers["Cache-Control"] == "no-store, max-age=0"
+    assert client.get(f"api/user?number=pi&amount=10", auth=TEST_USER_STD).headers["Cache-Control"] == \
+        "no-store, max-age=0"
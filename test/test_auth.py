@@ -0,0 +1,70 @@
+import http
+from unittest import mock
+
+from credential_cache import CredentialCache
+from database import TEST_USER_STD, TEST_USER_ADMIN
+from test_api import PI_FIRST_10
+
+status = http.HTTPStatus
+
+
+def get_token(client, auth):
+    response = client.post("/api/token", auth=auth)
+    assert response.status_code == status.CREATED
+    return {"Authorization": f"Bearer {response.json['token']}"}
+
+
+def test_token_needs_password(client):
+    assert client.post("/api/token").status_code == status.UNAUTHORIZED
+    assert client.post("/api/token", auth=(TEST_USER_STD[0], "wrong")).status_code == status.UNAUTHORIZED
+
+
+def test_token_replaces_password(client):
+    headers = get_token(client, TEST_USER_STD)
+    assert client.get("/api/user?number=pi&amount=10", headers=headers).data == PI_FIRST_10
+    assert client.get("/api/user?number=pi", headers=headers).data == PI_FIRST_10
+    assert client.get("/admin/users", headers=headers).status_code == status.FORBIDDEN  # Not an admin
+    assert client.get("/admin/users", headers=get_token(client, TEST_USER_ADMIN)).status_code == status.OK
+    assert client.get("/api/user?number=pi", headers={"Authorization": "Bearer wrong"}).status_code == \
+        status.NOT_FOUND
+
+
+def test_token_can_be_deleted(client):
+    headers = get_token(client, TEST_USER_ADMIN)
+    assert client.delete("/api/token", headers=headers).status_code == status.OK
+    assert client.get("/admin/users", headers=headers).status_code == status.UNAUTHORIZED
+
+
+def test_password_change_and_deletion_end_tokens_and_cached_passwords(client):
+    client.post("/admin/users", auth=TEST_USER_ADMIN, json={"username": "test_user", "password": "test_password"})
+    headers = get_token(client, ("test_user", "test_password"))  # Also remembers the password
+    client.patch("/admin/users/test_user", auth=TEST_USER_ADMIN, json={"password": "new_password"})
+    assert client.get("/api/user?number=e", headers=headers).status_code == status.NOT_FOUND
+    assert client.get("/api/user?number=e", auth=("test_user", "test_password")).status_code == status.NOT_FOUND
+    assert client.get("/api/user?number=e", auth=("test_user", "new_password")).status_code == status.OK
+
+    headers = get_token(client, ("test_user", "new_password"))
+    client.delete("/admin/users/test_user", auth=TEST_USER_ADMIN)
+    assert client.get("/api/user?number=e", headers=headers).status_code == status.NOT_FOUND
+    assert client.get("/api/user?number=e", auth=("test_user", "new_password")).status_code == status.NOT_FOUND
+
+
+def test_verified_passwords_skip_hash_check(client):
+    with mock.patch("web.check_password_hash", return_value=True) as check_password_hash:
+        for _ in range(5):
+            assert client.get("/admin/users", auth=TEST_USER_ADMIN).status_code == status.OK
+    assert check_password_hash.call_count == 1
+
+
+def test_credential_cache_expires():
+    cache = CredentialCache(ttl=10)
+    cache.add("felix", "mady")
+    assert cache.is_verified("felix", "mady")
+    assert not cache.is_verified("felix", "wrong")
+    with mock.patch("time.monotonic", return_value=float("inf")):
+        assert not cache.is_verified("felix", "mady")
+    cache.invalidate("felix")
+    assert not cache.is_verified("felix", "mady")
+    disabled = CredentialCache(ttl=0)
+    disabled.add("felix", "mady")
+    assert not disabled.is_verified("felix", "mady")
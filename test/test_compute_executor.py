@@ -0,0 +1,54 @@
+import http
+import threading
+import time
+
+import pytest
+
+from compute_executor import ComputeExecutor, ComputeBusyError, ComputeTimeoutError
+from irrational_digits import Pi, Root, compute_fraction_in_process, set_executor, BACKEND_NATIVE
+from test_api import PI_FIRST_10, PI_NEXT_10
+from web import create_app, CONFIG_COMPUTE_PROCESSES, CONFIG_COMPUTE_THRESHOLD
+
+
+@pytest.fixture
+def executor():
+    executor = ComputeExecutor(processes=1, queue_depth=1, timeout=30, threshold=100)
+    yield executor
+    executor.shutdown()
+
+
+def test_expensive_computations_run_in_pool(executor):
+    fraction = executor.run(1000, compute_fraction_in_process, Pi(), 1000, BACKEND_NATIVE)
+    assert fraction == Pi().compute_fraction(1000)
+    assert executor.run(1000, compute_fraction_in_process, Root(3, 3), 1000, BACKEND_NATIVE) == \
+        Root(3, 3).compute_fraction(1000)
+
+
+def test_cheap_computations_run_in_thread(executor):
+    assert executor.run(10, threading.get_ident) == threading.get_ident()
+
+
+def test_full_queue_is_busy(executor):
+    executor.run(1000, time.sleep, 0)  # Starts the process
+    blocker = threading.Thread(target=executor.run, args=(1000, time.sleep, 1))
+    blocker.start()
+    time.sleep(0.2)
+    with pytest.raises(ComputeBusyError):
+        executor.run(1000, time.sleep, 0)
+    blocker.join()
+
+
+def test_slow_computations_time_out():
+    executor = ComputeExecutor(processes=1, queue_depth=1, timeout=0.1, threshold=0)
+    with pytest.raises(ComputeTimeoutError):
+        executor.run(1000, time.sleep, 2)
+    executor.shutdown()
+
+
+def test_app_computes_in_pool(tmp_path):
+    app = create_app(tmp_path, {CONFIG_COMPUTE_PROCESSES: 1, CONFIG_COMPUTE_THRESHOLD: 0})
+    with app.test_client() as client:
+        response = client.get("api?number=pi&index=0&amount=20")
+        assert response.status_code == http.HTTPStatus.OK
+        assert response.data == PI_FIRST_10 + PI_NEXT_10
+    set_executor(None)
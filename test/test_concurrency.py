@@ -0,0 +1,52 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import mpmath
+import pytest
+
+from digit_store import set_store_folder
+from irrational_digits import Pi, E, Sqrt2, Root, set_backend, set_executor, set_cache_budget, \
+    get_cache_stats, BACKENDS, DEFAULT_CACHE_BUDGET
+
+REFERENCE_ACCURACY = 1200
+
+
+def reference_digits(constant):
+    ctx = mpmath.MPContext()
+    ctx.dps = REFERENCE_ACCURACY + 20
+    return str(constant(ctx))[:REFERENCE_ACCURACY + 2]
+
+
+REFERENCES = {Pi: reference_digits(lambda ctx: ctx.pi),
+              E: reference_digits(lambda ctx: ctx.e),
+              Sqrt2: reference_digits(lambda ctx: ctx.sqrt(2))}
+
+
+@pytest.fixture
+def without_store():
+    set_store_folder(None)  # Every call computes its number
+    set_cache_budget(0)
+    set_executor(None)
+    yield
+    set_backend(BACKENDS[-1])
+    set_cache_budget(DEFAULT_CACHE_BUDGET)
+
+
+def check_random_digits(seed):
+    rand = random.Random(seed)
+    for _ in range(20):
+        number = rand.choice(list(REFERENCES))
+        index = rand.randrange(1, REFERENCE_ACCURACY - 100)
+        amount = rand.randrange(1, 100)
+        assert number().get_digits(index, amount) == REFERENCES[number][index + 2:index + 2 + amount]
+        assert number().get_digits(0, amount) == REFERENCES[number][:amount + 2]
+        assert Root(2).get_digit_at_index(index) == REFERENCES[Sqrt2][index + 1]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_get_digits_from_many_threads(without_store, backend):
+    set_backend(backend)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for result in executor.map(check_random_digits, range(64)):
+            assert result is None
+    assert get_cache_stats()["hits"] == 0  # Every read computed its number
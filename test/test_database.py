@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from werkzeug.serving import make_server
+
+from database import create_connection, create_db_tables, db_execute, db_query, get_digit_from_number_digits, \
+    db_raise_current_index, db_raise_current_indices, db_get_current_index, ConnectionManager, DIGIT_BLOCK_SIZE, \
+    TEST_USER_STD, TEST_USER_ADMIN
+from irrational_digits import Pi, E
+from web import create_app, CONFIG_PRECOMPUTE_MARGIN
+
+PI_DIGITS = "31415926535897932384626433832795"
+
+
+def count_blocks(conn, number):
+    return db_execute(conn, "SELECT COUNT(*) FROM number_digit_blocks WHERE number =:number", {'number': number})[0]
+
+
+def test_digits_are_saved_in_blocks(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    conn = create_connection(tmp_path / "pithon.db")
+    assert get_digit_from_number_digits(conn, Pi, 5) == PI_DIGITS[5]
+    assert count_blocks(conn, "pi") == 1
+    digits = Pi().get_digits(0, 2 * DIGIT_BLOCK_SIZE + 10).replace(".", "")
+    assert get_digit_from_number_digits(conn, Pi, 2 * DIGIT_BLOCK_SIZE + 3) == digits[2 * DIGIT_BLOCK_SIZE + 3]
+    assert count_blocks(conn, "pi") == 3
+    assert get_digit_from_number_digits(conn, Pi, DIGIT_BLOCK_SIZE - 1) == digits[DIGIT_BLOCK_SIZE - 1]
+    assert count_blocks(conn, "e") == 0
+
+
+def test_old_digit_table_is_migrated(tmp_path):
+    conn = sqlite3.connect(tmp_path / "pithon.db")
+    conn.execute("CREATE TABLE number_digits (number text, digit_index integer, digit integer)")
+    conn.executemany("INSERT INTO number_digits VALUES (?, ?, ?)",
+                     [("pi", i, int(digit)) for i, digit in enumerate(PI_DIGITS[:11])] + [("e", 0, 2), ("e", 1, 7)])
+    conn.commit()
+    conn.close()
+
+    create_db_tables(tmp_path / "pithon.db")
+    conn = create_connection(tmp_path / "pithon.db")
+    assert db_execute(conn, "SELECT name FROM sqlite_master WHERE name = 'number_digits'", {}) is None
+    assert count_blocks(conn, "pi") == 1
+    assert count_blocks(conn, "e") == 1
+    assert [get_digit_from_number_digits(conn, Pi, i) for i in range(11)] == list(PI_DIGITS[:11])
+    assert get_digit_from_number_digits(conn, E, 1) == "7"
+    assert get_digit_from_number_digits(conn, Pi, 20) == PI_DIGITS[20]  # Fills the partly migrated block
+    assert count_blocks(conn, "pi") == 1
+
+
+def test_connection_manager_uses_wal_and_one_connection_per_thread(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    manager = ConnectionManager(tmp_path / "pithon.db")
+    assert db_query(manager, "PRAGMA journal_mode;", {})[0] == "wal"
+    barrier = threading.Barrier(4)
+
+    def get_connection(_):
+        barrier.wait()  # Each call runs in a thread of its own
+        return manager.get_connection()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        connections = list(executor.map(get_connection, range(4)))
+    assert len({id(conn) for conn in connections}) == 4
+    assert manager.get_connection() is manager.get_connection()
+
+
+def test_short_lived_threads_reuse_pooled_connections(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    manager = ConnectionManager(tmp_path / "pithon.db", pool_size=2)
+
+    def read_and_release():
+        db_get_current_index(manager, TEST_USER_STD[0], "pi")
+        manager.release()
+
+    with mock.patch("database.create_connection", wraps=create_connection) as connect:
+        for _ in range(20):
+            thread = threading.Thread(target=read_and_release)
+            thread.start()
+            thread.join()
+        assert connect.call_count == 1
+
+        barrier = threading.Barrier(4)
+
+        def read_together():
+            db_get_current_index(manager, TEST_USER_STD[0], "pi")
+            barrier.wait()
+            manager.release()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: read_together(), range(4)))
+        assert connect.call_count == 4
+        assert len(manager._idle) == 2  # The other connections were closed
+
+
+def test_threaded_server_reuses_connections(tmp_path):
+    app = create_app(tmp_path, {CONFIG_PRECOMPUTE_MARGIN: 0})
+    server = make_server("127.0.0.1", 0, app, threaded=True)  # One thread per request
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with mock.patch("database.create_connection", wraps=create_connection) as connect:
+            for i in range(50):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/db/pi/{i}").read()
+            assert connect.call_count <= 1
+    finally:
+        server.shutdown()
+
+
+def test_reads_see_writes_of_other_threads(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    manager = ConnectionManager(tmp_path / "pithon.db")
+    assert db_get_current_index(manager, TEST_USER_STD[0], "pi") == 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(db_raise_current_index, manager, TEST_USER_STD[0], "pi", 10).result()
+    assert db_get_current_index(manager, TEST_USER_STD[0], "pi") == 10
+    assert not manager.get_connection().in_transaction  # Reads never leave a transaction open
+
+
+def test_concurrent_raises_are_not_lost(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    manager = ConnectionManager(tmp_path / "pithon.db")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        indices = list(executor.map(lambda _: db_raise_current_index(manager, TEST_USER_STD[0], "pi", 10), range(80)))
+    assert sorted(indices) == list(range(10, 810, 10))
+    assert db_get_current_index(manager, TEST_USER_STD[0], "pi") == 800
+    assert db_raise_current_index(manager, "nobody", "pi", 10) == -1
+
+
+def test_many_indices_are_raised_at_once(tmp_path):
+    create_db_tables(tmp_path / "pithon.db")
+    manager = ConnectionManager(tmp_path / "pithon.db")
+    increments = [(TEST_USER_STD[0], "pi", 5), (TEST_USER_ADMIN[0], "e", 3), ("nobody", "pi", 1),
+                  (TEST_USER_STD[0], "pi", 7)]
+    assert db_raise_current_indices(manager, increments) == [5, 3, -1, 12]
+    assert db_get_current_index(manager, TEST_USER_ADMIN[0], "e") == 3
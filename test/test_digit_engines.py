@@ -0,0 +1,59 @@
+import mpmath
+import pytest
+
+from digit_engines import ChudnovskyPi, SeriesE, IntegerRoot, get_root_engine
+
+
+def mpmath_reference(constant, accuracy):
+    ctx = mpmath.MPContext()
+    ctx.dps = accuracy + 20
+    return str(constant(ctx))[:accuracy + 2]
+
+
+@pytest.mark.parametrize("accuracy", [1, 9, 100, 4000])
+def test_chudnovsky_pi_is_exact(accuracy):
+    assert ChudnovskyPi().get_number_with_accuracy(accuracy) == mpmath_reference(lambda ctx: ctx.pi, accuracy)
+
+
+def test_chudnovsky_pi_extends_saved_state():
+    engine = ChudnovskyPi()
+    engine.get_number_with_accuracy(1000)
+    terms = engine.terms
+    assert engine.get_number_with_accuracy(500) == mpmath_reference(lambda ctx: ctx.pi, 500)
+    assert engine.terms == terms  # Fewer digits need no new terms
+    assert engine.get_number_with_accuracy(2000) == ChudnovskyPi().get_number_with_accuracy(2000)
+    assert engine.terms > terms
+
+
+@pytest.mark.parametrize("accuracy", [1, 9, 100, 4000])
+def test_series_e_is_exact(accuracy):
+    assert SeriesE().get_number_with_accuracy(accuracy) == mpmath_reference(lambda ctx: ctx.e, accuracy)
+
+
+def test_series_e_extends_saved_state():
+    engine = SeriesE()
+    engine.get_number_with_accuracy(1000)
+    terms = engine.terms
+    assert engine.get_number_with_accuracy(2000) == SeriesE().get_number_with_accuracy(2000)
+    assert engine.terms > terms
+
+
+@pytest.mark.parametrize("radicand,degree", [(2, 2), (3, 2), (150, 2), (3, 3), (7, 3), (999, 3)])
+def test_integer_root_is_exact(radicand, degree):
+    engine = IntegerRoot(radicand, degree)
+    for accuracy in [1, 40, 41, 1000]:
+        reference = mpmath_reference(lambda ctx: ctx.root(radicand, degree), accuracy + len(str(engine.integer_part)))
+        assert engine.get_number_with_accuracy(accuracy) == reference[:accuracy + len(str(engine.integer_part)) + 1]
+
+
+def test_integer_root_refines_previous_root():
+    engine = IntegerRoot(3, 3)
+    engine.get_scaled(1000)
+    assert engine.get_scaled(1100) == IntegerRoot(3, 3).get_scaled(1100)
+    assert engine.accuracy == 1100
+    assert engine.get_scaled(10) == IntegerRoot(3, 3).get_scaled(10)
+
+
+def test_root_engines_are_cached():
+    assert get_root_engine(5, 3) is get_root_engine(5, 3)
+    assert get_root_engine(5, 3) is not get_root_engine(5, 2)
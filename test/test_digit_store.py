@@ -0,0 +1,65 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from digit_store import DigitStore, set_store_folder, get_store
+from irrational_digits import Pi, E, Sqrt2, set_cache_budget, DEFAULT_CACHE_BUDGET
+
+PI_FRACTION_30 = "141592653589793238462643383279"
+
+
+def test_store_is_empty_at_start(tmp_path):
+    assert len(DigitStore(tmp_path / "pi.digits")) == 0
+
+
+def test_store_extends_and_reads_digits(tmp_path):
+    store = DigitStore(tmp_path / "pi.digits")
+    store.extend(PI_FRACTION_30[:7])  # odd length leaves a half filled byte
+    store.extend(PI_FRACTION_30[:20])
+    store.extend(PI_FRACTION_30[:3])  # shorter extensions change nothing
+    assert len(store) == 20
+    assert store.read(0, 20) == PI_FRACTION_30[:20]
+    for start in range(20):
+        assert store.read(start, 20 - start) == PI_FRACTION_30[start:20]
+
+
+def test_store_is_persistent(tmp_path):
+    DigitStore(tmp_path / "pi.digits").extend(PI_FRACTION_30)
+    store = DigitStore(tmp_path / "pi.digits")
+    assert len(store) == 30
+    assert store.read(25, 5) == PI_FRACTION_30[25:30]
+
+
+def test_store_can_not_read_missing_digits(tmp_path):
+    store = DigitStore(tmp_path / "pi.digits")
+    store.extend(PI_FRACTION_30[:10])
+    with pytest.raises(IndexError):
+        store.read(5, 10)
+
+
+def extend_store(path, amount):
+    DigitStore(path).extend(PI_FRACTION_30[:amount])
+
+
+def test_processes_never_lower_the_header(tmp_path):
+    path = tmp_path / "pi.digits"  # Created by the processes, so they also race to create it
+    amounts = [30, 3, 17, 8, 29, 1, 12] * 10
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as executor:
+        list(executor.map(extend_store, [path] * len(amounts), amounts))
+    store = DigitStore(path)
+    assert len(store) == 30
+    assert store.read(0, 30) == PI_FRACTION_30
+
+
+@pytest.mark.parametrize("number", [Pi, E, Sqrt2])
+def test_numbers_are_served_from_store(tmp_path, number):
+    set_store_folder(tmp_path)
+    set_cache_budget(0)  # Only the store can serve the digits
+    computed = number().get_number_with_accuracy(1500)
+    assert number().get_digits(0, 1500) == computed
+    assert len(get_store(number.name)) >= 1500
+    assert number().get_digits(700, 50) == computed[702:752]
+    assert number().get_digit_at_index(1500) == computed[-1]
+    set_store_folder(None)
+    set_cache_budget(DEFAULT_CACHE_BUDGET)
@@ -16,6 +16,16 @@ def test_download_returns_file(client, number, first_twenty):
     assert download.headers.get("content-disposition") == f"attachment; filename={number}.txt"
 
 
+@pytest.mark.parametrize("number,first_twenty", [("pi", PI_FIRST_10 + PI_NEXT_10),
+                                                 ("e", E_FIRST_10 + E_NEXT_10)])
+def test_download_supports_ranges(client, number, first_twenty):
+    client.get(f"api?number={number}&amount=20")
+    download = client.get(f"api/download?number={number}", headers={"Range": "bytes=2-11"})
+    assert download.status_code == http.HTTPStatus.PARTIAL_CONTENT
+    assert download.data == first_twenty[2:12]
+    assert download.headers["Content-Range"] == "bytes 2-11/22"
+
+
 @pytest.mark.parametrize("number", ["pi", "e", "sqrt2"])
 def test_download_of_empty_file_fails(client, number):
     download = client.get(f"/digits/{number}")
@@ -0,0 +1,50 @@
+import time
+
+from irrational_digits import ExpansionCache, Pi, get_cache_stats
+from web import create_app, CONFIG_CACHE_PREWARM, CONFIG_CACHE_BUDGET, CONFIG_PRECOMPUTE_MARGIN
+
+PI_FRACTION_30 = "141592653589793238462643383279"
+
+
+def test_cache_counts_hits_and_misses():
+    cache = ExpansionCache(100)
+    assert cache.get("pi", 10) is None
+    cache.put("pi", PI_FRACTION_30)
+    assert cache.get("pi", 30) == PI_FRACTION_30
+    assert cache.get("pi", 31) is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 30)
+
+
+def test_cache_keeps_largest_expansion():
+    cache = ExpansionCache(100)
+    cache.put("pi", PI_FRACTION_30)
+    cache.put("pi", PI_FRACTION_30[:10])
+    assert cache.get("pi", 30) == PI_FRACTION_30
+    assert cache.get_stats()["size"] == 30
+
+
+def test_cache_evicts_least_recently_used_numbers():
+    cache = ExpansionCache(70)
+    cache.put("pi", PI_FRACTION_30)
+    cache.put("e", "7" * 30)
+    cache.get("pi", 1)
+    cache.put("sqrt2", "4" * 30)  # Evicts e, which was used last
+    assert cache.get("e", 1) is None
+    assert cache.get("pi", 1) == PI_FRACTION_30
+    cache.put("sqrt3", "7" * 71)  # Larger than the budget, so it is not cached
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["numbers"] == {"sqrt2": 30, "pi": 30}
+
+
+def test_app_prewarms_cache(tmp_path):
+    # Without precomputation, which would fill the small cache with other numbers
+    create_app(tmp_path, {CONFIG_CACHE_BUDGET: 10000, CONFIG_CACHE_PREWARM: {"pi": 2000}, CONFIG_PRECOMPUTE_MARGIN: 0})
+    for _ in range(100):
+        if get_cache_stats()["numbers"].get("pi", 0) >= 2000:
+            break
+        time.sleep(0.05)
+    hits = get_cache_stats()["hits"]
+    assert Pi().get_digits(1990, 10) == Pi().compute_fraction(2000)[1990:]
+    assert get_cache_stats()["hits"] == hits + 1
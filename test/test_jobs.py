@@ -0,0 +1,111 @@
+import http
+import time
+
+from database import create_connection, create_jobs_table, db_create_job, db_get_job, db_set_job_state, \
+    db_delete_jobs_finished_before, JOB_COMPUTING, JOB_DONE, JOB_FAILED
+from jobs import get_job_id
+from web import create_app, CONFIG_JOB_EXPIRY, CONFIG_JOB_MAX_DIGITS, CONFIG_MAX_JOBS, CONFIG_JOBS_PER_CLIENT
+
+status = http.HTTPStatus
+
+
+def wait_for_job(client, job_id, state=JOB_DONE):
+    for _ in range(100):
+        response = client.get(f"/api/jobs/{job_id}")
+        if response.status_code != status.OK or response.json["state"] == state:
+            return response
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not get {state}")
+
+
+def test_job_result_can_be_downloaded(client):
+    response = client.post("/api/jobs", json={"number": "pi", "index": 5, "amount": 3000})
+    assert response.status_code == status.ACCEPTED
+    job_id = response.json["id"]
+    assert response.headers["Location"] == f"/api/jobs/{job_id}"
+
+    job = wait_for_job(client, job_id).json
+    assert job["progress"] == 1.0 and job["expires"] > job["created"]
+    result = client.get(job["result"])
+    assert result.headers["Content-Disposition"] == "attachment; filename=pi-5-3000.txt"
+    assert result.text == client.get("/api?number=pi&index=5&amount=3000").text
+
+    root_job = client.post("/api/jobs", json={"number": "cbrt", "n": 3, "index": 0, "amount": 20}).json
+    assert client.get(wait_for_job(client, root_job["id"]).json["result"]).text == "1.44224957030740838232"
+
+
+def test_equal_jobs_are_done_once(client):
+    first = client.post("/api/jobs", json={"number": "e", "index": 0, "amount": 100}).json
+    second = client.post("/api/jobs", json={"number": "e", "index": 0, "amount": 100}).json
+    assert first["id"] == second["id"] and first["created"] == second["created"]
+    assert client.post("/api/jobs", json={"number": "e", "index": 1, "amount": 100}).json["id"] != first["id"]
+
+
+def test_jobs_are_checked(client):
+    assert client.post("/api/jobs", json={"number": "tau", "amount": 10}).status_code == status.BAD_REQUEST
+    assert client.post("/api/jobs", json={"number": "pi", "index": 5}).status_code == status.BAD_REQUEST
+    assert client.post("/api/jobs", json=[{"number": "pi"}]).status_code == status.BAD_REQUEST
+    assert client.get("/api/jobs/unknown").status_code == status.NOT_FOUND
+    assert client.get("/api/jobs/unknown/result").status_code == status.NOT_FOUND
+
+
+def test_too_large_jobs_are_refused(tmp_path):
+    client = create_app(tmp_path, {CONFIG_JOB_MAX_DIGITS: 1000}).test_client()
+    assert client.post("/api/jobs", json={"number": "pi", "index": 1, "amount": 1000}).status_code == \
+        status.BAD_REQUEST
+
+
+def test_jobs_table_without_returning(tmp_path):
+    conn = create_connection(tmp_path / "jobs.db")
+    create_jobs_table(conn)
+    assert db_create_job(conn, "a", "pi", None, 0, 5, 1.0)
+    assert not db_create_job(conn, "a", "pi", None, 0, 5, 2.0)  # Kept
+    db_set_job_state(conn, "a", JOB_FAILED, finished=3.0)
+    assert db_create_job(conn, "a", "pi", None, 0, 5, 4.0)  # Queued again
+    db_set_job_state(conn, "a", JOB_DONE, finished=5.0)
+    assert db_delete_jobs_finished_before(conn, 5.0) == []
+    assert db_delete_jobs_finished_before(conn, 6.0) == ["a"]
+    assert db_get_job(conn, "a") is None
+
+
+def test_unfinished_jobs_per_client_are_limited(tmp_path):
+    client = create_app(tmp_path, {CONFIG_JOBS_PER_CLIENT: 2}).test_client()
+    conn = create_connection(tmp_path / "pithon.db")
+    for index in range(2):  # Waiting, they are not queued before the next start
+        db_create_job(conn, get_job_id("pi", None, index, 10), "pi", None, index, 10, time.time(), "ip:127.0.0.1")
+    response = client.post("/api/jobs", json={"number": "pi", "index": 2, "amount": 10})
+    assert response.status_code == status.TOO_MANY_REQUESTS and "Retry-After" in response.headers
+    assert client.post("/api/jobs", json={"number": "pi", "index": 1, "amount": 10}).status_code == status.ACCEPTED
+    assert client.post("/api/jobs", json={"number": "pi", "index": 2, "amount": 10},
+                       environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == status.ACCEPTED
+
+
+def test_total_jobs_are_limited(tmp_path):
+    client = create_app(tmp_path, {CONFIG_MAX_JOBS: 2}).test_client()
+    jobs = [client.post("/api/jobs", json={"number": "e", "index": index, "amount": 10},
+                        environ_base={"REMOTE_ADDR": f"10.0.0.{index}"}) for index in range(3)]
+    assert [job.status_code for job in jobs] == [status.ACCEPTED, status.ACCEPTED, status.TOO_MANY_REQUESTS]
+    wait_for_job(client, jobs[0].json["id"])  # Done jobs count until they expire
+    assert client.post("/api/jobs", json={"number": "e", "index": 5, "amount": 10}).status_code == \
+        status.TOO_MANY_REQUESTS
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path):
+    create_app(tmp_path)
+    conn = create_connection(tmp_path / "pithon.db")
+    job_id = get_job_id("sqrt2", None, 3, 50)
+    db_create_job(conn, job_id, "sqrt2", None, 3, 50, time.time())
+    conn.execute("UPDATE jobs SET state = ?", (JOB_COMPUTING,))  # Interrupted by the restart
+    conn.commit()
+
+    client = create_app(tmp_path).test_client()
+    job = wait_for_job(client, job_id).json
+    assert client.get(job["result"]).text == client.get("/api?number=sqrt2&index=3&amount=50").text
+
+
+def test_finished_jobs_expire(tmp_path):
+    client = create_app(tmp_path, {CONFIG_JOB_EXPIRY: 0.5}).test_client()
+    job_id = client.post("/api/jobs", json={"number": "pi", "index": 0, "amount": 10}).json["id"]
+    assert wait_for_job(client, job_id, state=None).status_code == status.NOT_FOUND
+    assert not (tmp_path / "jobs" / f"{job_id}.txt").exists()
+    assert db_get_job(create_connection(tmp_path / "pithon.db"), job_id) is None
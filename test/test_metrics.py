@@ -0,0 +1,64 @@
+import http
+
+import metrics
+from database import TEST_USER_STD, TEST_USER_ADMIN
+from web import create_app, CONFIG_METRICS
+
+status = http.HTTPStatus
+
+
+def test_histogram_is_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test", buckets=(0.1, 1))
+    for value in [0.05, 0.5, 0.5, 3]:
+        histogram.observe(value, endpoint="/api")
+    assert histogram.render() == ['test_seconds_bucket{endpoint="/api",le="0.1"} 1',
+                                  'test_seconds_bucket{endpoint="/api",le="1"} 3',
+                                  'test_seconds_bucket{endpoint="/api",le="+Inf"} 4',
+                                  'test_seconds_sum{endpoint="/api"} 4.05',
+                                  'test_seconds_count{endpoint="/api"} 4']
+
+
+def test_labels_are_escaped():
+    counter = metrics.Counter("test_total", "Test")
+    counter.inc(statement='SELECT "a"\n  FROM b')
+    counter.inc(2, statement='SELECT "a"\n  FROM b')
+    assert counter.render() == ['test_total{statement="SELECT \\"a\\" FROM b"} 3']
+
+
+def test_nothing_is_timed_when_disabled():
+    histogram = metrics.Histogram("test_seconds", "Test")
+    metrics.set_metrics_enabled(False)
+    with metrics.timed(histogram):
+        pass
+    assert histogram.get_count() == 0
+    metrics.set_metrics_enabled(True)
+    with metrics.timed(histogram, number="pi"):
+        pass
+    assert histogram.get_count(number="pi") == 1
+    metrics.set_metrics_enabled(False)
+
+
+def test_metrics_endpoint(tmp_path):
+    client = create_app(tmp_path, {CONFIG_METRICS: True}).test_client()
+    client.get("/api?number=pi&index=5&amount=2000")
+    client.get("/api?number=pi&index=5&amount=2000")
+    client.get("/api/user?number=e&amount=10", auth=TEST_USER_STD)
+    client.get("/api/user?number=e&amount=10", auth=TEST_USER_STD)
+    assert client.get("/admin/metrics", auth=TEST_USER_STD).status_code == status.FORBIDDEN
+
+    response = client.get("/admin/metrics", auth=TEST_USER_ADMIN)
+    assert response.status_code == status.OK
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'pithon_request_seconds_count{endpoint="/api",method="GET",status="200"} 2' in text
+    assert 'pithon_compute_seconds_count{digits="1e4",number="pi"}' in text
+    assert 'pithon_digit_reads_total{source="cache"}' in text
+    assert 'pithon_db_query_seconds_count{statement="UPDATE number_indices SET current_index' in text
+    assert 'pithon_credential_cache_requests_total{result="hit"}' in text
+    assert "pithon_password_check_seconds_count" in text
+    assert "pithon_expansion_cache_requests_total" in text
+    metrics.set_metrics_enabled(False)
+
+
+def test_metrics_can_be_disabled(client):
+    assert client.get("/admin/metrics", auth=TEST_USER_ADMIN).status_code == status.NOT_FOUND
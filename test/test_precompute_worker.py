@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from database import TEST_USER_ADMIN, TEST_USER_STD
+from digit_store import set_store_folder
+from irrational_digits import Pi, E
+from precompute_worker import PrecomputeWorker, set_worker, get_worker_status
+from web import create_app, CONFIG_PRECOMPUTE_MARGIN, CONFIG_PRECOMPUTE_INTERVAL
+
+
+def test_worker_extends_store_ahead_of_watermarks(tmp_path):
+    set_store_folder(tmp_path)
+    worker = PrecomputeWorker([Pi(), E()], lambda: {"pi": 3000}, margin=2000, max_depth=4000)
+    assert worker.run_once() > 0
+    assert len(Pi().digit_store) >= 4000
+    assert len(E().digit_store) >= 2000
+    assert worker.status["pi"]["target"] == 4000  # Limited by max_depth
+    assert worker.run_once() == 0  # Nothing left to compute
+    assert worker.status["e"]["computations"] == 1
+    set_store_folder(None)
+
+
+def test_worker_extends_store_from_cache(tmp_path):
+    set_store_folder(None)
+    Pi().prewarm(3000)  # Only the cache holds these digits
+    set_store_folder(tmp_path)
+    worker = PrecomputeWorker([Pi()], lambda: {"pi": 1000}, margin=2000)
+    worker.run_once()
+    assert len(Pi().digit_store) >= 3000
+    assert worker.run_once() == 0
+    set_store_folder(None)
+
+
+def test_worker_needs_valid_cpu_share():
+    with pytest.raises(ValueError):
+        PrecomputeWorker([Pi()], dict, cpu_share=0)
+
+
+def test_app_precomputes_for_users(tmp_path):
+    app = create_app(tmp_path, {CONFIG_PRECOMPUTE_MARGIN: 1500, CONFIG_PRECOMPUTE_INTERVAL: 0.05})
+    client = app.test_client()
+    client.post("api/user?number=pi&index=5000", auth=TEST_USER_STD)
+    for _ in range(100):
+        if len(Pi().digit_store) >= 6500:
+            break
+        time.sleep(0.05)
+    assert get_worker_status()["numbers"]["pi"]["watermark"] == 5000
+    assert len(Pi().digit_store) >= 6500
+
+    client.post("login", data={"username": TEST_USER_ADMIN[0], "password": TEST_USER_ADMIN[1]})
+    assert b"Precomputation: 1500 digits ahead" in client.get("admin").data
+    set_worker(None)
@@ -0,0 +1,76 @@
+import http
+import json
+import pstats
+import tracemalloc
+from unittest import mock
+
+from database import TEST_USER_STD, TEST_USER_ADMIN
+from profiler import RequestProfiler
+
+status = http.HTTPStatus
+
+
+def read_slow_log(client):
+    response = client.get("/admin/profiling/slow_log", auth=TEST_USER_ADMIN)
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_profiling_is_off_by_default(client):
+    assert client.get("/admin/profiling", auth=TEST_USER_STD).status_code == status.FORBIDDEN
+    client.get("/api?number=pi&index=3&amount=5&profile")
+    assert client.get("/admin/profiling", auth=TEST_USER_ADMIN).json == \
+        {"enabled": False, "sample_rate": 0.01, "slow_threshold": 1.0, "profiles": []}
+
+
+def test_profiles_and_slow_requests_are_saved(client, tmp_path):
+    response = client.patch("/admin/profiling", auth=TEST_USER_ADMIN,
+                            json={"enabled": True, "sample_rate": 0, "slow_threshold": 0})
+    assert response.json["enabled"]
+    client.get("/api?number=e&index=3&amount=500&profile")
+    client.get("/api?number=pi&index=3&amount=5")  # Not sampled, but slow
+    profiles = client.get("/admin/profiling", auth=TEST_USER_ADMIN).json["profiles"]
+    assert [profile["path"] for profile in profiles] == ["/api"]
+
+    download = client.get(f"/admin/profiling/{profiles[0]['id']}", auth=TEST_USER_ADMIN)
+    assert download.status_code == status.OK
+    (tmp_path / "downloaded.prof").write_bytes(download.data)
+    assert pstats.Stats(str(tmp_path / "downloaded.prof")).total_calls > 0
+    assert client.get("/admin/profiling/1-1", auth=TEST_USER_ADMIN).status_code == status.NOT_FOUND
+
+    entries = [entry for entry in read_slow_log(client) if entry["path"] == "/api"]
+    assert entries[0]["parameters"] == {"number": "e", "index": "3", "amount": "500", "profile": ""}
+    assert entries[0]["peak_memory"] > 0 and len(entries[0]["top_functions"]) > 0
+    assert entries[1]["parameters"]["number"] == "pi" and "top_functions" not in entries[1]
+
+
+def test_profiling_settings_are_checked(client):
+    assert client.patch("/admin/profiling", auth=TEST_USER_ADMIN, json={"sample_rate": 2}).status_code == \
+        status.BAD_REQUEST
+    assert client.patch("/admin/profiling", auth=TEST_USER_ADMIN, json={"unknown": 1}).status_code == \
+        status.BAD_REQUEST
+
+
+def test_old_profiles_are_deleted(tmp_path):
+    profiler = RequestProfiler(tmp_path, enabled=True, max_profiles=2)
+    for i in range(3):
+        profiler.stop(profiler.start(forced=True), "GET", "/api", {}, 200)
+    assert len(profiler.profiles) == 2
+    assert sorted(path.name for path in tmp_path.glob("*.prof")) == \
+        sorted(f"{profile['id']}.prof" for profile in profiler.profiles)
+
+
+def test_one_request_at_a_time_is_profiled(tmp_path):
+    profiler = RequestProfiler(tmp_path, enabled=True)
+    first = profiler.start(forced=True)
+    second = profiler.start(forced=True)
+    assert first["profile"] is not None and second["profile"] is None
+    profiler.stop(second, "GET", "/api", {}, 200)
+    profiler.stop(first, "GET", "/api", {}, 200)
+    assert not tracemalloc.is_tracing()
+
+    with mock.patch("cProfile.Profile.enable", side_effect=ValueError("Another profiling tool is already active")):
+        assert profiler.start(forced=True)["profile"] is None
+    assert not tracemalloc.is_tracing()
+    measurement = profiler.start(forced=True)
+    assert measurement["profile"] is not None
+    profiler.stop(measurement, "GET", "/api", {}, 200)
@@ -0,0 +1,40 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from irrational_digits import Pi, E, Root
+
+AMOUNTS = [1, 7, 10, 3, 25, 11] * 20
+
+
+def test_processes_append_valid_prefix(tmp_path):
+    path = tmp_path / "pi.txt"
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as executor:
+        answers = list(executor.map(Pi().get_next_digits_for_txt_file, AMOUNTS, [path] * len(AMOUNTS)))
+    progress = path.read_text()
+    assert progress == Pi().get_digits(0, sum(AMOUNTS))
+    assert Pi().get_txt_cursor(path) == sum(AMOUNTS)
+    assert sum(len(answer) for answer in answers) == len(progress)  # No digits were written twice
+
+
+def test_threads_append_and_reset(tmp_path):
+    path = tmp_path / "e.txt"
+
+    def append_or_reset(i):
+        if i % 10 == 9:
+            E.reset_txt_file(path)
+        else:
+            E().get_next_digits_for_txt_file(5, path)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(append_or_reset, range(100)))
+    progress = path.read_text()
+    assert progress == E().get_digits(0, E().get_txt_cursor(path)) or progress == ""
+
+
+def test_cursor_of_multi_digit_integer_part(tmp_path):
+    path = tmp_path / "sqrt150.txt"
+    root = Root(150)
+    assert root.get_next_digits_for_txt_file(5, path) == "12.24744"
+    assert root.get_next_digits_for_txt_file(5, path) == "87139"
+    assert root.get_txt_cursor(path) == 10
+    assert path.read_text() == root.get_digits(0, 10)
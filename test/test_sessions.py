@@ -0,0 +1,87 @@
+import http
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+from database import TEST_USER_ADMIN
+from session_backends import delete_expired_sessions, set_session_cleanup, SESSION_BACKENDS, SESSION_COOKIE, \
+    PUBLIC_SECRET_KEY
+from web import create_app, CONFIG_SESSION_BACKEND
+
+status = http.HTTPStatus
+
+
+def login(client):
+    return client.post("/login", data={"username": TEST_USER_ADMIN[0], "password": TEST_USER_ADMIN[1]})
+
+
+SECRET_KEY = "a secret only the server knows"
+
+
+@pytest.mark.parametrize("backend", SESSION_BACKENDS)
+def test_sessions_of_all_backends(tmp_path, backend):
+    client = create_app(tmp_path, {CONFIG_SESSION_BACKEND: backend, "SECRET_KEY": SECRET_KEY}).test_client()
+    assert client.get("/admin").status_code == status.FORBIDDEN
+    assert login(client).status_code == status.OK
+    assert client.get("/admin").status_code == status.OK
+    client.get("/toggle_theme")
+    with client.session_transaction() as session:
+        assert session["theme"] == "dark"
+    client.get("/logout")
+    assert client.get("/admin").status_code == status.FORBIDDEN
+
+
+def test_cookie_sessions_need_a_secret_key(tmp_path, monkeypatch):
+    monkeypatch.delenv("PITHON_SECRET_KEY", raising=False)
+    with pytest.raises(ValueError):
+        create_app(tmp_path, {CONFIG_SESSION_BACKEND: SESSION_COOKIE})
+    with pytest.raises(ValueError):
+        create_app(tmp_path, {CONFIG_SESSION_BACKEND: SESSION_COOKIE, "SECRET_KEY": "short"})
+    monkeypatch.setenv("PITHON_SECRET_KEY", SECRET_KEY)
+    assert create_app(tmp_path, {CONFIG_SESSION_BACKEND: SESSION_COOKIE}).secret_key == SECRET_KEY
+
+
+def test_sessions_signed_with_the_public_key_are_refused(tmp_path):
+    app = create_app(tmp_path, {CONFIG_SESSION_BACKEND: SESSION_COOKIE, "SECRET_KEY": SECRET_KEY})
+    app.secret_key = PUBLIC_SECRET_KEY
+    forged = SecureCookieSessionInterface().get_signing_serializer(app).dumps({"username": TEST_USER_ADMIN[0]})
+    app.secret_key = SECRET_KEY
+    client = app.test_client()
+    client.set_cookie("localhost", app.config["SESSION_COOKIE_NAME"], forged)
+    assert client.get("/admin").status_code == status.FORBIDDEN
+
+
+def test_unknown_session_backend(tmp_path):
+    with pytest.raises(ValueError):
+        create_app(tmp_path, {CONFIG_SESSION_BACKEND: "redis"})
+
+
+def test_memory_sessions_expire(tmp_path):
+    client = create_app(tmp_path, {CONFIG_SESSION_BACKEND: "memory"}).test_client()
+    login(client)
+    later = (datetime.now() + timedelta(days=32)).timestamp()
+    with mock.patch("cachelib.simple.time", return_value=later):
+        assert client.get("/admin").status_code == status.FORBIDDEN
+
+
+def test_sqlalchemy_sessions_are_kept_in_the_storage_folder(tmp_path):
+    client = create_app(tmp_path / "storage").test_client()
+    assert login(client).status_code == status.OK
+    assert (tmp_path / "storage" / "sessions.db").exists()
+
+
+def test_expired_sqlalchemy_sessions_are_deleted(tmp_path):
+    app = create_app(tmp_path)
+    set_session_cleanup(None)
+    delete_expired_sessions(app)
+    login(app.test_client())
+    login(app.test_client())
+    model = app.session_interface.sql_session_model
+    with app.app_context():
+        session = model.query.order_by(model.id.desc()).first()
+        session.expiry = datetime.utcnow() - timedelta(seconds=1)
+        app.session_interface.db.session.commit()
+    assert delete_expired_sessions(app) == 1
+    assert delete_expired_sessions(app) == 0
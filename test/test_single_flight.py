@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+DIGITS = "1415926535897932384626433832795028841971"
+
+
+def slow_compute(release, targets):
+    def compute(target):
+        targets.append(target)
+        release.wait()
+        return DIGITS[:target]
+    return compute
+
+
+def run_while_blocked(flight, requests):
+    release, targets = threading.Event(), []
+    compute = slow_compute(release, targets)
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        futures = []
+        for key, target in requests:
+            futures.append(executor.submit(flight.run, key, target, compute))
+            time.sleep(0.05)  # The first request is the running computation, the others join it
+        release.set()
+        return [future.result() for future in futures], targets
+
+
+def test_requests_with_lower_precision_share_the_computation():
+    flight = SingleFlight()
+    results, targets = run_while_blocked(flight, [("pi", 30), ("pi", 10), ("pi", 30), ("pi", 20)])
+    assert targets == [30]
+    assert all(result == DIGITS[:30] for result in results)
+
+
+def test_requests_with_higher_precision_raise_the_target():
+    flight = SingleFlight()
+    results, targets = run_while_blocked(flight, [("pi", 10), ("pi", 25), ("pi", 40), ("pi", 5)])
+    assert targets == [10, 40]
+    assert all(len(result) >= target for result, target in zip(results, [10, 25, 40, 5]))
+
+
+def test_different_numbers_are_computed_separately():
+    flight = SingleFlight()
+    results, targets = run_while_blocked(flight, [("pi", 10), ("e", 10)])
+    assert sorted(targets) == [10, 10]
+
+
+def test_errors_reach_all_waiting_requests():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_compute(target):
+        release.wait()
+        raise ValueError("computation failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.run, "pi", 10, failing_compute)
+        time.sleep(0.05)
+        follower = executor.submit(flight.run, "pi", 5, failing_compute)
+        time.sleep(0.05)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    assert flight.run("pi", 5, lambda target: DIGITS[:target]) == DIGITS[:5]
@@ -1,12 +1,27 @@
 import http
+import threading
+import time
 from collections import namedtuple
-from flask import Flask, request, send_file, render_template, redirect, session
-from flask_httpauth import HTTPBasicAuth
-from flask_session import Session
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, send_file, render_template, redirect, session, make_response, g
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
 from werkzeug.security import check_password_hash
 from database import *
-from irrational_digits import Pi, E, Sqrt2
+import metrics
+from credential_cache import CredentialCache, DEFAULT_TTL
+from compute_executor import ComputeExecutor, ComputeBusyError, ComputeTimeoutError, DEFAULT_PROCESSES, \
+    DEFAULT_QUEUE_DEPTH, DEFAULT_TIMEOUT, DEFAULT_THRESHOLD
+from digit_store import set_store_folder
+from session_backends import init_session, set_session_cleanup, SESSION_SQLALCHEMY, DEFAULT_CLEANUP_INTERVAL, \
+    PUBLIC_SECRET_KEY
+from admission_control import AdmissionController, OverBudgetError, CostTooHighError, estimate_cost, get_max_cost, \
+    DEFAULT_CAPACITY, DEFAULT_REFILL_RATE, DEFAULT_HEAVY_COST, DEFAULT_MAX_HEAVY
+from jobs import JobRunner, JobLimitError, set_job_runner, DEFAULT_JOB_EXPIRY, DEFAULT_JOB_MAX_DIGITS, \
+    DEFAULT_MAX_JOBS, DEFAULT_JOBS_PER_CLIENT
+from profiler import RequestProfiler, DEFAULT_SAMPLE_RATE, DEFAULT_SLOW_THRESHOLD
+from precompute_worker import PrecomputeWorker, set_worker, get_worker_status, DEFAULT_MARGIN, DEFAULT_MAX_DEPTH, \
+    DEFAULT_CPU_SHARE, DEFAULT_INTERVAL
+from irrational_digits import Pi, E, Sqrt2, Root, set_backend, set_executor, set_cache_budget, \
+    BACKEND_NATIVE, ROOT_DEGREES, MAX_RADICAND, DEFAULT_CACHE_BUDGET
 from pathlib import Path
 
 status = http.HTTPStatus
@@ -14,40 +29,153 @@ CONFIG_DB_PATH = "DB_PATH"
 CONFIG_PI_TXT_PATH = "PI_TXT_PATH"
 CONFIG_E_TXT_PATH = "E_TXT_PATH"
 CONFIG_SQRT2_TXT_PATH = "SQRT2_TXT_PATH"
+CONFIG_DIGIT_STORE_PATH = "DIGIT_STORE_PATH"
+CONFIG_SESSION_DB_PATH = "SESSION_DB_PATH"
+CONFIG_BACKEND = "NUMBER_BACKEND"
+CONFIG_COMPUTE_PROCESSES = "COMPUTE_PROCESSES"
+CONFIG_COMPUTE_QUEUE_DEPTH = "COMPUTE_QUEUE_DEPTH"
+CONFIG_COMPUTE_TIMEOUT = "COMPUTE_TIMEOUT"
+CONFIG_COMPUTE_THRESHOLD = "COMPUTE_THRESHOLD"
+CONFIG_CACHE_BUDGET = "CACHE_BUDGET"
+CONFIG_CACHE_PREWARM = "CACHE_PREWARM"
+CONFIG_PRECOMPUTE_MARGIN = "PRECOMPUTE_MARGIN"
+CONFIG_PRECOMPUTE_MAX_DEPTH = "PRECOMPUTE_MAX_DEPTH"
+CONFIG_PRECOMPUTE_CPU_SHARE = "PRECOMPUTE_CPU_SHARE"
+CONFIG_PRECOMPUTE_INTERVAL = "PRECOMPUTE_INTERVAL"
+CONFIG_AUTH_CACHE_TTL = "AUTH_CACHE_TTL"
+CONFIG_SESSION_BACKEND = "SESSION_BACKEND"
+CONFIG_SESSION_CLEANUP_INTERVAL = "SESSION_CLEANUP_INTERVAL"
+CONFIG_METRICS = "METRICS"
+CONFIG_PROFILING = "PROFILING"
+CONFIG_PROFILE_SAMPLE_RATE = "PROFILE_SAMPLE_RATE"
+CONFIG_SLOW_REQUEST_THRESHOLD = "SLOW_REQUEST_THRESHOLD"
+CONFIG_ADMISSION_CAPACITY = "ADMISSION_CAPACITY"
+CONFIG_ADMISSION_REFILL_RATE = "ADMISSION_REFILL_RATE"
+CONFIG_ADMISSION_MAX_COST = "ADMISSION_MAX_COST"
+CONFIG_HEAVY_COMPUTATION_COST = "HEAVY_COMPUTATION_COST"
+CONFIG_MAX_HEAVY_COMPUTATIONS = "MAX_HEAVY_COMPUTATIONS"
+CONFIG_JOB_EXPIRY = "JOB_EXPIRY"
+CONFIG_JOB_MAX_DIGITS = "JOB_MAX_DIGITS"
+CONFIG_MAX_JOBS = "MAX_JOBS"
+CONFIG_JOBS_PER_CLIENT = "JOBS_PER_CLIENT"
+
+# Settings, which can be changed with the config parameter of create_app()
+DEFAULT_CONFIG = {CONFIG_BACKEND: BACKEND_NATIVE,
+                  CONFIG_COMPUTE_PROCESSES: DEFAULT_PROCESSES,
+                  CONFIG_COMPUTE_QUEUE_DEPTH: DEFAULT_QUEUE_DEPTH,
+                  CONFIG_COMPUTE_TIMEOUT: DEFAULT_TIMEOUT,
+                  CONFIG_COMPUTE_THRESHOLD: DEFAULT_THRESHOLD,
+                  CONFIG_CACHE_BUDGET: DEFAULT_CACHE_BUDGET,
+                  CONFIG_CACHE_PREWARM: {},  # e.g. {"pi": 100000} to cache 100000 digits of pi at start
+                  CONFIG_PRECOMPUTE_MARGIN: DEFAULT_MARGIN,
+                  CONFIG_PRECOMPUTE_MAX_DEPTH: DEFAULT_MAX_DEPTH,
+                  CONFIG_PRECOMPUTE_CPU_SHARE: DEFAULT_CPU_SHARE,
+                  CONFIG_PRECOMPUTE_INTERVAL: DEFAULT_INTERVAL,
+                  CONFIG_AUTH_CACHE_TTL: DEFAULT_TTL,
+                  CONFIG_SESSION_BACKEND: SESSION_SQLALCHEMY,  # "memory" or "cookie", see session_backends.py
+                  CONFIG_SESSION_CLEANUP_INTERVAL: DEFAULT_CLEANUP_INTERVAL,
+                  CONFIG_METRICS: False,  # Prometheus metrics on /admin/metrics
+                  CONFIG_PROFILING: False,  # Can also be switched on /admin/profiling
+                  CONFIG_PROFILE_SAMPLE_RATE: DEFAULT_SAMPLE_RATE,
+                  CONFIG_SLOW_REQUEST_THRESHOLD: DEFAULT_SLOW_THRESHOLD,
+                  CONFIG_ADMISSION_CAPACITY: DEFAULT_CAPACITY,  # digits, see admission_control.py
+                  CONFIG_ADMISSION_REFILL_RATE: DEFAULT_REFILL_RATE,
+                  CONFIG_ADMISSION_MAX_COST: None,  # digits one request may compute, None fits them into the timeout
+                  CONFIG_HEAVY_COMPUTATION_COST: DEFAULT_HEAVY_COST,
+                  CONFIG_MAX_HEAVY_COMPUTATIONS: DEFAULT_MAX_HEAVY,
+                  CONFIG_JOB_EXPIRY: DEFAULT_JOB_EXPIRY,  # seconds
+                  CONFIG_JOB_MAX_DIGITS: DEFAULT_JOB_MAX_DIGITS,
+                  CONFIG_MAX_JOBS: DEFAULT_MAX_JOBS,  # queued, running or kept until their expiry
+                  CONFIG_JOBS_PER_CLIENT: DEFAULT_JOBS_PER_CLIENT}  # unfinished jobs of one IP
 
 CONFIG_TXT_PATH_MAPPING = {Pi.name: CONFIG_PI_TXT_PATH, E.name: CONFIG_E_TXT_PATH, Sqrt2.name: CONFIG_SQRT2_TXT_PATH}
 CLASS_MAPPING = {Pi.name: Pi, E.name: E, Sqrt2.name: Sqrt2}
 STD_DIGIT_AMOUNT = 10
+MAX_BATCH_QUERIES = 1000
+PASSWORD_SECONDS = metrics.histogram("pithon_password_check_seconds", "Time to check a password hash")
+CREDENTIAL_CACHE_REQUESTS = metrics.counter("pithon_credential_cache_requests_total",
+                                            "Basic auth checks answered by the credential cache or not")
+REQUEST_SECONDS = metrics.histogram("pithon_request_seconds", "Latency of the requests per endpoint")
+# Digits never change, so responses identified by number, index and amount can be cached by anyone for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
 Err = namedtuple("Err", ["is_err", "message", "status"], defaults=None)
 
 
-def create_app(storage_folder="./db/"):
+def create_app(storage_folder="./db/", config=None):
     """
     Formatted according to https://flask.palletsprojects.com/en/2.2.x/tutorial/factory/
     :param storage_folder: folder the database should use
+    :param config: settings overriding DEFAULT_CONFIG
     :return: app
     """
     app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
     app.config[CONFIG_DB_PATH] = Path(storage_folder) / "pithon.db"
     app.config[CONFIG_PI_TXT_PATH] = Path(storage_folder) / "pi.txt"
     app.config[CONFIG_E_TXT_PATH] = Path(storage_folder) / "e.txt"
     app.config[CONFIG_SQRT2_TXT_PATH] = Path(storage_folder) / "sqrt2.txt"
+    app.config[CONFIG_DIGIT_STORE_PATH] = Path(storage_folder) / "digits"
     txt_path_mapping = {Pi.name: app.config[CONFIG_PI_TXT_PATH], E.name: app.config[CONFIG_E_TXT_PATH],
                         Sqrt2.name: app.config[CONFIG_SQRT2_TXT_PATH]}
-    app.config["SECRET_KEY"] = "PiThon"
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///db.sqlite3"
-    app.config["SESSION_TYPE"] = "sqlalchemy"
-    db = SQLAlchemy(app)
-    app.config["SESSION_SQLALCHEMY"] = db
+    app.config["SECRET_KEY"] = app.config.get("SECRET_KEY") or os.environ.get("PITHON_SECRET_KEY") or PUBLIC_SECRET_KEY
+    app.config[CONFIG_SESSION_DB_PATH] = Path(storage_folder) / "sessions.db"
+    # Absolute, because Flask-SQLAlchemy puts relative sqlite paths into the instance folder of the app
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{app.config[CONFIG_SESSION_DB_PATH].resolve()}"
     auth = HTTPBasicAuth()
-    Session(app)
-
-    with app.app_context():
-        db.create_all()
+    token_auth = HTTPTokenAuth(scheme="Bearer")
+    multi_auth = MultiAuth(auth, token_auth)  # Accepts basic auth or a token issued on /api/token
+    credential_cache = CredentialCache(app.config[CONFIG_AUTH_CACHE_TTL])
+    metrics.set_metrics_enabled(app.config[CONFIG_METRICS])
+    profiler = RequestProfiler(Path(storage_folder) / "profiles", app.config[CONFIG_PROFILING],
+                               app.config[CONFIG_PROFILE_SAMPLE_RATE], app.config[CONFIG_SLOW_REQUEST_THRESHOLD])
+    max_cost = app.config[CONFIG_ADMISSION_MAX_COST]
+    if max_cost is None:
+        max_cost = get_max_cost(app.config[CONFIG_COMPUTE_TIMEOUT])
+    admission = AdmissionController(app.config[CONFIG_ADMISSION_CAPACITY], app.config[CONFIG_ADMISSION_REFILL_RATE],
+                                    app.config[CONFIG_HEAVY_COMPUTATION_COST], app.config[CONFIG_MAX_HEAVY_COMPUTATIONS],
+                                    max_cost)
+    init_session(app, app.config[CONFIG_SESSION_BACKEND])
+    set_session_cleanup(app if app.config[CONFIG_SESSION_BACKEND] == SESSION_SQLALCHEMY else None,
+                        app.config[CONFIG_SESSION_CLEANUP_INTERVAL])
 
     create_db_tables(app.config[CONFIG_DB_PATH])
-    conn = create_connection(app.config[CONFIG_DB_PATH])
+    set_store_folder(app.config[CONFIG_DIGIT_STORE_PATH])
+    set_backend(app.config[CONFIG_BACKEND])
+    set_executor(ComputeExecutor(app.config[CONFIG_COMPUTE_PROCESSES], app.config[CONFIG_COMPUTE_QUEUE_DEPTH],
+                                 app.config[CONFIG_COMPUTE_TIMEOUT], app.config[CONFIG_COMPUTE_THRESHOLD]))
+    set_cache_budget(app.config[CONFIG_CACHE_BUDGET])
+    for number, depth in app.config[CONFIG_CACHE_PREWARM].items():
+        threading.Thread(target=CLASS_MAPPING[number]().prewarm, args=(depth,), daemon=True).start()
+    conn = ConnectionManager(app.config[CONFIG_DB_PATH])
+
+    def get_watermarks():
+        # The furthest index of all users and the cursor of the anonymous txt file
+        watermarks = db_get_max_current_indices(conn)
+        for number, path in txt_path_mapping.items():
+            watermarks[number] = max(watermarks.get(number, 0), CLASS_MAPPING[number]().get_txt_cursor(path))
+        return watermarks
+
+    set_worker(PrecomputeWorker([number() for number in CLASS_MAPPING.values()], get_watermarks,
+                                app.config[CONFIG_PRECOMPUTE_MARGIN], app.config[CONFIG_PRECOMPUTE_MAX_DEPTH],
+                                app.config[CONFIG_PRECOMPUTE_CPU_SHARE], app.config[CONFIG_PRECOMPUTE_INTERVAL])
+               if app.config[CONFIG_PRECOMPUTE_MARGIN] > 0 else None)
+
+    def create_job_number(number, radicand):
+        return Root(radicand, ROOT_DEGREES[number]) if number in ROOT_DEGREES else CLASS_MAPPING[number]()
+
+    job_runner = JobRunner(conn, Path(storage_folder) / "jobs", create_job_number, app.config[CONFIG_JOB_EXPIRY],
+                           app.config[CONFIG_MAX_JOBS], app.config[CONFIG_JOBS_PER_CLIENT])
+    set_job_runner(job_runner)
+
+    def delete_user(user):
+        db_delete_user(conn, user)
+        credential_cache.invalidate(user)
+
+    def set_password(user, password):
+        db_set_password(conn, user, password)
+        credential_cache.invalidate(user)
 
     def check_user_exists(user) -> Err:
         if not db_is_user_existing(conn, user):
@@ -69,7 +197,9 @@ def create_app(storage_folder="./db/"):
         return Err(False, None, None)
 
     def check_password(user, password) -> Err:
-        if not check_password_hash(db_get_password(conn, user), password):
+        with metrics.timed(PASSWORD_SECONDS):
+            correct = check_password_hash(db_get_password(conn, user), password)
+        if not correct:
             return Err(True, "Wrong username or password.", status.FORBIDDEN)
         return Err(False, None, None)
 
@@ -87,9 +217,31 @@ def create_app(storage_folder="./db/"):
         return f"""<p>{text}</p><br>
                    <a href=/{path}>{link_message}</a>""", http_status
 
+    def create_immutable_response(etag, create_response):
+        """ Returns 304 Not Modified, if the client knows the etag already. Otherwise create_response() is called.
+            Both get a strong ETag and may be cached by clients and proxies.
+            """
+        if request.if_none_match.contains(etag):
+            response = Response(status=status.NOT_MODIFIED)
+        else:
+            response = make_response(create_response())
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    def get_bearer_token():
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        return token if scheme.lower() == "bearer" and token else None
+
     def api_get_username():
         user = request.authorization.username if request.authorization is not None else None
-        if user is None:
+        if user is None and get_bearer_token() is not None:
+            user = verify_token(get_bearer_token())
+            if user is None:
+                raise RuntimeError({"message": "Invalid token.", "status": status.NOT_FOUND})
+        elif user is None:
             user = session.get("username")
             if user is None:
                 raise RuntimeError({"message": "No username given. Please log in or use auth.", "status": status.NOT_FOUND})
@@ -97,14 +249,26 @@ def create_app(storage_folder="./db/"):
             raise RuntimeError({"message": "Wrong username or password.", "status": status.NOT_FOUND})
         return user
 
-    def api_get_number():
+    def api_get_number(allow_roots=False):
         number = request.args.get("number")
         if number is not None:
-            if number not in CLASS_MAPPING.keys():
+            if number not in CLASS_MAPPING.keys() and not (allow_roots and number in ROOT_DEGREES):
                 raise RuntimeError({"message": "Unknown number.", "status": status.NOT_FOUND})
             return number
         return None
 
+    def api_get_radicand():
+        n = request.args.get("n")
+        if n is None or not n.isnumeric() or not 0 < int(n) <= MAX_RADICAND:
+            raise RuntimeError({"message": f"Invalid n. Roots need 0 < n <= {MAX_RADICAND}.",
+                                "status": status.BAD_REQUEST})
+        return int(n)
+
+    def create_number_instance(number):
+        if number in ROOT_DEGREES:
+            return Root(api_get_radicand(), ROOT_DEGREES[number])
+        return CLASS_MAPPING[number]()
+
     def api_get_index():
         index = request.args.get("index")
         if index is not None:
@@ -121,6 +285,20 @@ def create_app(storage_folder="./db/"):
             return int(amount)
         return None
 
+    def admit_digits(depths, user=None):
+        """ Charges the digits to compute to the budgets of the client and the user.
+            Raises OverBudgetError, if they can't afford them.
+            :param depths: [(number instance, end)] with the digits after the decimal point to read up to end
+            """
+        cost = sum(estimate_cost(end, number_instance.get_available_digits()) for number_instance, end in depths)
+        keys = [f"ip:{request.remote_addr}"] + ([f"user:{user}"] if user is not None else [])
+        if admission.admit(keys, cost):
+            g.heavy_slot = True  # Released after the request by release_heavy_slot()
+
+    def release_heavy_slot_when_done(future):
+        """ Gives the heavy slot back, when the computation really ends. It goes on in its process after a timeout. """
+        future.add_done_callback(lambda f: admission.release_heavy())
+
     @app.get('/api/user')
     def api_get_number_with_user():
         try:
@@ -129,40 +307,188 @@ def create_app(storage_folder="./db/"):
             index = api_get_index()
             amount = api_get_amount()
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
 
         if number is None or index is not None:
             return render_template("api_help.jinja", message="Unknown operation."), status.BAD_REQUEST
 
         number_instance = CLASS_MAPPING[number]()
+        current_index = db_get_current_index(conn, user, number)
+        admit_digits([(number_instance, current_index + (amount or 0))], user)
 
         if amount is None:
-            return number_instance.get_digits(0, db_get_current_index(conn, user, number)), status.OK
-        return number_instance.get_digits_for_user(user, amount, app.config[CONFIG_DB_PATH]), status.OK
+            return number_instance.get_digits(0, current_index), status.OK
+        return number_instance.get_digits_for_user(user, amount, conn), status.OK
 
     @app.get('/api')
     def api_get_number_without_user():
         try:
-            number = api_get_number()
+            number = api_get_number(allow_roots=True)
             index = api_get_index()
             amount = api_get_amount()
+            number_instance = create_number_instance(number) if number is not None else None
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
 
         if number is None:
             return render_template("api_help.jinja"), status.BAD_REQUEST
 
-        number_instance = CLASS_MAPPING[number]()
-        path = txt_path_mapping[number]
-
         if index is None:
+            if number not in txt_path_mapping:  # Only the fixed numbers have a global progress
+                return render_template("api_help.jinja", message="Roots need an index."), status.BAD_REQUEST
+            path = txt_path_mapping[number]
             if amount is None:
-                return number_instance.get_all_from_file(path), status.OK
+                if not os.path.exists(path):
+                    return "", status.OK
+                return send_file(path, mimetype="text/html")  # The file is not read into memory
+            admit_digits([(number_instance, number_instance.get_txt_cursor(path) + amount)])
             return number_instance.get_next_digits_for_txt_file(amount, path), status.OK
 
+        admit_digits([(number_instance, index + (amount or 0))])
         if amount is None:
-            return number_instance.get_digit_at_index(index), status.OK
-        return number_instance.get_digits(index, amount), status.OK
+            return create_immutable_response(f"{number_instance.name}-{index}",
+                                             lambda: (number_instance.get_digit_at_index(index), status.OK))
+        return create_immutable_response(f"{number_instance.name}-{index}-{amount}",
+                                         lambda: (number_instance.get_digits(index, amount), status.OK))
+
+    @app.get('/api/stream')
+    def api_stream_digits():
+        try:
+            number = api_get_number(allow_roots=True)
+            index = api_get_index()
+            amount = api_get_amount()
+            number_instance = create_number_instance(number) if number is not None else None
+        except RuntimeError as err:
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
+
+        if number is None or amount is None:
+            return render_template("api_help.jinja", message="Streams need a number and an amount."), \
+                status.BAD_REQUEST
+
+        index = index or 0
+        admit_digits([(number_instance, index + amount)])
+
+        def create_stream():
+            blocks = number_instance.iter_fraction(index, index + amount)
+            # The first block is read before the response starts, so errors still get their own status code
+            first_block = next(blocks, "")
+
+            heavy_slot = g.pop("heavy_slot", False)  # Kept until the stream ends
+
+            def generate():
+                nonlocal heavy_slot
+                try:
+                    if index == 0:
+                        yield number_instance.first_digit + ("." if amount > 0 else "")
+                    yield first_block
+                    yield from blocks
+                except ComputeTimeoutError as err:
+                    if heavy_slot:
+                        heavy_slot = False
+                        release_heavy_slot_when_done(err.future)
+                    raise
+
+            def close():
+                if heavy_slot:
+                    admission.release_heavy()
+
+            response = Response(generate(), status.OK, mimetype="text/plain")
+            response.call_on_close(close)
+            return response
+
+        return create_immutable_response(f"{number_instance.name}-{index}-{amount}-stream", create_stream)
+
+    def batch_get_query(query):
+        number, index, amount = query.get("number"), query.get("index", 0), query.get("amount")
+        if number in ROOT_DEGREES:
+            radicand = query.get("n")
+            if type(radicand) is not int or not 0 < radicand <= MAX_RADICAND:
+                raise ValueError(f"Roots need 0 < n <= {MAX_RADICAND}.")
+            number_instance = Root(radicand, ROOT_DEGREES[number])
+        elif number in CLASS_MAPPING:
+            number_instance = CLASS_MAPPING[number]()
+        else:
+            raise ValueError("Unknown number.")
+        if type(index) is not int or index < 0 or not (amount is None or type(amount) is int and amount >= 0):
+            raise ValueError("Invalid index or amount.")
+        return number_instance, index, amount
+
+    @app.post('/api/batch')
+    def api_batch_get_digits():
+        """ Answers a JSON list of queries like {"number": "pi", "index": 5, "amount": 10} in the same order.
+            Every number is computed only once, up to the deepest digit requested of it.
+            """
+        check = check_request_is_json(request)
+        if check.is_err:
+            return check.message, check.status
+        queries = request.get_json()
+        if type(queries) is not list or len(queries) > MAX_BATCH_QUERIES:
+            return f"Send a list of at most {MAX_BATCH_QUERIES} queries.", status.BAD_REQUEST
+
+        parsed_queries = []
+        for position, query in enumerate(queries):
+            try:
+                parsed_queries.append(batch_get_query(query))
+            except (ValueError, AttributeError) as err:
+                return f"Query {position}: {err}", status.BAD_REQUEST
+
+        depths = {}
+        for number_instance, index, amount in parsed_queries:
+            end = index if amount is None else index + amount
+            if end > depths.get(number_instance.name, (None, 0))[1]:
+                depths[number_instance.name] = (number_instance, end)
+        admit_digits(depths.values())
+        for number_instance, end in depths.values():
+            number_instance.get_fraction(end - 1, end)  # Computes the number once, the queries are read from the store
+
+        return [number_instance.get_digit_at_index(index) if amount is None else
+                number_instance.get_digits(index, amount) for number_instance, index, amount in parsed_queries], status.OK
+
+    def create_job_response(job):
+        response = {"id": job["job_id"], "number": job["number"], "n": job["radicand"], "index": job["start_index"],
+                    "amount": job["amount"], "state": job["state"], "progress": job["progress"],
+                    "error": job["error"], "created": job["created"], "expires": job.get("expires")}
+        if job["state"] == JOB_DONE:
+            response["result"] = f"/api/jobs/{job['job_id']}/result"
+        return response
+
+    @app.post('/api/jobs')
+    def api_create_job():
+        """ Starts computing {"number": "pi", "index": 5, "amount": 10000000} in the background.
+            Answers the job at once. Its state and the progress can be polled on /api/jobs/<id>.
+            """
+        check = check_request_is_json(request)
+        if check.is_err:
+            return check.message, check.status
+        query = request.get_json()
+        try:
+            number_instance, index, amount = batch_get_query(query)
+        except (ValueError, AttributeError) as err:
+            return str(err), status.BAD_REQUEST
+        if amount is None or index + amount > app.config[CONFIG_JOB_MAX_DIGITS]:
+            return f"Jobs need an amount and may read up to digit {app.config[CONFIG_JOB_MAX_DIGITS]}.", \
+                status.BAD_REQUEST
+        radicand = number_instance.radicand if query["number"] in ROOT_DEGREES else None
+        job = job_runner.submit(query["number"], radicand, index, amount, f"ip:{request.remote_addr}")
+        return create_job_response(job), status.ACCEPTED, {"Location": f"/api/jobs/{job['job_id']}"}
+
+    @app.get('/api/jobs/<job_id>')
+    def api_get_job(job_id):
+        job = job_runner.get_job(job_id)
+        if job is None:
+            return "Unknown or expired job.", status.NOT_FOUND
+        return create_job_response(job), status.OK
+
+    @app.get('/api/jobs/<job_id>/result')
+    def api_download_job_result(job_id):
+        job = job_runner.get_job(job_id)
+        if job is None:
+            return "Unknown or expired job.", status.NOT_FOUND
+        if job["state"] != JOB_DONE:
+            return f"The job is not done yet, but {job['state']}.", status.CONFLICT
+        name = job["number"] + str(job["radicand"] or "")
+        return send_file(job_runner.get_result_path(job_id), as_attachment=True,
+                         download_name=f"{name}-{job['start_index']}-{job['amount']}.txt")
 
     @app.post('/api/user')
     def api_post_set_user_index():
@@ -171,7 +497,7 @@ def create_app(storage_folder="./db/"):
             number = api_get_number()
             index = api_get_index()
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
 
         if number is None or index is None:
             return render_template("api_help.jinja", message="Unknown request."), status.BAD_REQUEST
@@ -197,12 +523,12 @@ def create_app(storage_folder="./db/"):
         try:
             user = api_get_username()
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
         req = request.get_json() if request.is_json else None
 
         if req is None or not req["confirm_deletion"]:
             return render_template("api_help.jinja", message="Insufficient json data."), status.BAD_REQUEST
-        db_delete_user(conn, user)
+        delete_user(user)
         return f"{user} successfully deleted.", status.OK
 
     @app.delete('/api')
@@ -210,11 +536,9 @@ def create_app(storage_folder="./db/"):
         try:
             number = api_get_number()
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
-        path = txt_path_mapping[number]
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
         if number is not None:
-            with open(path, "w") as f:
-                f.truncate()
+            CLASS_MAPPING[number].reset_txt_file(txt_path_mapping[number])
             return f"{number} successfully reset.", status.OK
         return render_template("api_help.jinja", message="Number missing."), status.BAD_REQUEST
 
@@ -223,10 +547,10 @@ def create_app(storage_folder="./db/"):
         try:
             number = api_get_number()
         except RuntimeError as err:
-            return render_template("api_help.jinja", message=err.args.index("message")), err.args.index("status")
+            return render_template("api_help.jinja", message=err.args[0]["message"]), err.args[0]["status"]
         path = app.config[CONFIG_TXT_PATH_MAPPING[number]]
         if os.path.exists(path):
-            return send_file(path, as_attachment=True), status.OK
+            return send_file(path, as_attachment=True)  # Answers Range requests with 206 Partial Content
         return "File not found", status.NOT_FOUND
 
     @app.route('/')
@@ -235,8 +559,39 @@ def create_app(storage_folder="./db/"):
 
     @auth.verify_password
     def verify_password(username, password):
+        if credential_cache.is_verified(username, password):
+            if metrics.enabled:
+                CREDENTIAL_CACHE_REQUESTS.inc(result="hit")
+            return True
+        if metrics.enabled:
+            CREDENTIAL_CACHE_REQUESTS.inc(result="miss")
         pw_hash = db_get_password(conn, username)
-        return pw_hash is not None and check_password_hash(db_get_password(conn, username), password)
+        if pw_hash is None:
+            return False
+        with metrics.timed(PASSWORD_SECONDS):
+            correct = check_password_hash(pw_hash, password)
+        if not correct:
+            return False
+        credential_cache.add(username, password)
+        return True
+
+    @token_auth.verify_token
+    def verify_token(token):
+        return db_get_user_of_api_token(conn, token)
+
+    @app.post('/api/token')
+    @auth.login_required
+    def api_create_token():
+        """ Issues a token for the "Authorization: Bearer <token>" header, which is checked much faster than a password.
+            The token is shown only once. It stays valid until it is deleted or the password changes.
+            """
+        return {"token": db_create_api_token(conn, auth.current_user())}, status.CREATED
+
+    @app.delete('/api/token')
+    @token_auth.login_required
+    def api_delete_token():
+        db_delete_api_token(conn, get_bearer_token())
+        return "Token deleted.", status.OK
 
     @app.route('/tic_tac_toe')
     def tic_tac_toe():
@@ -314,7 +669,7 @@ def create_app(storage_folder="./db/"):
             if check.is_err:
                 return check.message, check.status
 
-            db_delete_user(conn, username)
+            delete_user(username)
             session.pop('username', None)
             return create_text_with_link_response(f"{username} deleted :(", status.OK)
         except (KeyError, ValueError):
@@ -325,7 +680,12 @@ def create_app(storage_folder="./db/"):
         check = check_is_known_number(num)
         if check.is_err:
             return create_text_with_link_response(check.message, check.message)
-        return get_digit_from_number_digits(conn, CLASS_MAPPING[num], index), status.OK
+        if db_get_number_digits_length(conn, CLASS_MAPPING[num]) <= index:
+            # Blocks hold the digit before the ".", so they end one digit after the point earlier
+            admit_digits([(CLASS_MAPPING[num](), get_number_digits_end(index) - 1)])
+        return create_immutable_response(f"{num}-db-{index}",
+                                         lambda: (get_digit_from_number_digits(conn, CLASS_MAPPING[num], index),
+                                                  status.OK))
 
     @app.route('/admin')
     def admin():
@@ -343,7 +703,7 @@ def create_app(storage_folder="./db/"):
         index_list = list(indices)
 
         return render_template("admin_panel.jinja", user_list=user_list, rank_list=rank_list, number_list=number_list,
-                               index_list=index_list), status.OK
+                               index_list=index_list, precompute_status=get_worker_status()), status.OK
 
     @app.route('/admin/delete', methods=['DELETE', 'POST'])
     def admin_delete():
@@ -356,13 +716,13 @@ def create_app(storage_folder="./db/"):
         if db_get_rank(conn, user) == "admin":
             return "You can´t delete admins.", status.FORBIDDEN
 
-        db_delete_user(conn, user)
+        delete_user(user)
         return redirect("/admin")
 
     @app.get('/admin/users')
-    @auth.login_required
+    @multi_auth.login_required
     def admin_get_all_users():
-        check = check_user_is_admin(auth.current_user())
+        check = check_user_is_admin(multi_auth.current_user())
         if check.is_err:
             return check.message, check.status
 
@@ -370,9 +730,9 @@ def create_app(storage_folder="./db/"):
         return users, status.OK
 
     @app.post('/admin/users')
-    @auth.login_required
+    @multi_auth.login_required
     def admin_add_user():
-        check = check_user_is_admin(auth.current_user())
+        check = check_user_is_admin(multi_auth.current_user())
         if check.is_err:
             return check.message, check.status
         check = check_request_is_json(request)
@@ -389,12 +749,12 @@ def create_app(storage_folder="./db/"):
             return "Invalid Request", status.BAD_REQUEST
 
     @app.patch('/admin/users/<user>')
-    @auth.login_required
+    @multi_auth.login_required
     def admin_change_password(user):
         check = check_user_exists(user)
         if check.is_err:
             return check.message, check.status
-        check = check_user_is_admin(auth.current_user())
+        check = check_user_is_admin(multi_auth.current_user())
         if check.is_err:
             return check.message, check.status
         check = check_request_is_json(request)
@@ -404,37 +764,153 @@ def create_app(storage_folder="./db/"):
         data = request.get_json()
 
         try:
-            db_set_password(conn, user, data["password"])
+            set_password(user, data["password"])
             return {"username": user, "password": "***"}, status.CREATED
         except (KeyError, ValueError):
             return "Invalid Request", status.BAD_REQUEST
 
     @app.delete('/admin/reset_all_indices')
-    @auth.login_required
+    @multi_auth.login_required
     def admin_reset_all_indices():
-        check = check_user_is_admin(auth.current_user())
+        check = check_user_is_admin(multi_auth.current_user())
         if check.is_err:
             return check.message, check.status
 
         db_reset_all_current_indices(conn)
         return "All indices are reset.", status.OK
 
+    @app.post('/admin/indices')
+    @multi_auth.login_required
+    def admin_raise_indices():
+        check = check_user_is_admin(multi_auth.current_user())
+        if check.is_err:
+            return check.message, check.status
+        check = check_request_is_json(request)
+        if check.is_err:
+            return check.message, check.status
+
+        try:
+            increments = [(item["username"], item["number"], int(item["increment"])) for item in request.get_json()]
+        except (KeyError, ValueError, TypeError):
+            return "Invalid Request", status.BAD_REQUEST
+        return db_raise_current_indices(conn, increments), status.OK
+
+    @app.get('/admin/metrics')
+    @multi_auth.login_required
+    def admin_metrics():
+        check = check_user_is_admin(multi_auth.current_user())
+        if check.is_err:
+            return check.message, check.status
+        if not metrics.enabled:
+            return "Metrics are disabled. Enable them with the METRICS setting.", status.NOT_FOUND
+        return metrics.render(), status.OK, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    @app.route('/admin/profiling', methods=['GET', 'PATCH'])
+    @multi_auth.login_required
+    def admin_profiling():
+        """ Shows the profiling settings and the recent profiles. PATCH changes the settings with JSON like
+            {"enabled": true, "sample_rate": 0.1, "slow_threshold": 0.5}.
+            """
+        check = check_user_is_admin(multi_auth.current_user())
+        if check.is_err:
+            return check.message, check.status
+        if request.method == "PATCH":
+            check = check_request_is_json(request)
+            if check.is_err:
+                return check.message, check.status
+            try:
+                profiler.set_settings(**request.get_json())
+            except (TypeError, ValueError) as err:
+                return f"Invalid Request: {err}", status.BAD_REQUEST
+        return {**profiler.get_settings(), "profiles": list(profiler.profiles)}, status.OK
+
+    @app.get('/admin/profiling/slow_log')
+    @multi_auth.login_required
+    def admin_download_slow_log():
+        check = check_user_is_admin(multi_auth.current_user())
+        if check.is_err:
+            return check.message, check.status
+        return send_file(profiler.slow_log_path, mimetype="text/plain", as_attachment=True)
+
+    @app.get('/admin/profiling/<profile_id>')
+    @multi_auth.login_required
+    def admin_download_profile(profile_id):
+        """ Downloads a profile, which can be read with pstats or tools like snakeviz. """
+        check = check_user_is_admin(multi_auth.current_user())
+        if check.is_err:
+            return check.message, check.status
+        if profile_id not in [profile["id"] for profile in profiler.profiles]:
+            return "Profile not found.", status.NOT_FOUND
+        return send_file(profiler.get_profile_path(profile_id), as_attachment=True)
+
     @app.delete('/admin/users/<user>')
-    @auth.login_required
+    @multi_auth.login_required
     def admin_delete_user(user):
         check = check_user_exists(user)
         if check.is_err:
             return check.message, check.status
-        check = check_user_is_admin(auth.current_user())
+        check = check_user_is_admin(multi_auth.current_user())
         if check.is_err:
             return check.message, check.status
 
-        db_delete_user(conn, user)
+        delete_user(user)
         return {}, status.OK
 
+    @app.errorhandler(ComputeBusyError)
+    def compute_busy(err):
+        return str(err), status.SERVICE_UNAVAILABLE, {"Retry-After": "10"}
+
+    @app.errorhandler(OverBudgetError)
+    def over_budget(err):
+        return str(err), status.TOO_MANY_REQUESTS, {"Retry-After": str(err.retry_after)}
+
+    @app.errorhandler(JobLimitError)
+    def job_limit(err):
+        return str(err), status.TOO_MANY_REQUESTS, {"Retry-After": str(err.retry_after)}
+
+    @app.errorhandler(CostTooHighError)
+    def cost_too_high(err):
+        return f"{err} Please use a job on /api/jobs for this amount of digits.", status.REQUEST_ENTITY_TOO_LARGE
+
+    @app.teardown_request
+    def release_connection(exc):
+        conn.release()
+
+    @app.teardown_request
+    def release_heavy_slot(exc):
+        if g.pop("heavy_slot", False):
+            admission.release_heavy()
+
+    @app.errorhandler(ComputeTimeoutError)
+    def compute_timeout(err):
+        if g.pop("heavy_slot", False):
+            release_heavy_slot_when_done(err.future)
+        return f"{err} Please use a job on /api/jobs for this amount of digits.", status.GATEWAY_TIMEOUT
+
+    @app.before_request
+    def start_request_timer():
+        if metrics.enabled:
+            g.request_start = time.perf_counter()
+        g.profile_measurement = profiler.start(forced="profile" in request.args)
+
+    @app.after_request
+    def stop_profiling(response):
+        if g.get("profile_measurement") is not None:
+            profiler.stop(g.profile_measurement, request.method, request.path, request.args.to_dict(),
+                          response.status_code)
+        return response
+
+    @app.after_request
+    def observe_request_time(response):
+        if "request_start" in g:
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unknown"
+            REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, method=request.method,
+                                    status=response.status_code)
+        return response
+
     @app.after_request
     def add_header(response):
-        if request.method == "GET":
+        if request.method == "GET" and not response.cache_control.immutable:
             response.headers['Cache-Control'] = 'no-store, max-age=0'
         return response
 